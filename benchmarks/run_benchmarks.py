@@ -0,0 +1,215 @@
+"""
+Benchmarks every data_extraction stage on the synthetic corpus at several scales
+and writes the results as JSON, optionally comparing them to an earlier run.
+
+    python benchmarks/run_benchmarks.py --scales 10000 100000 --baseline benchmarks/results/old.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Tuple
+
+import pandas as pd
+import toml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "data_extraction"))
+
+import clean_dataset
+import extract_documents
+import filter_urls
+import split_dataset
+from extractors import get_extractor
+from html_store import HtmlStore
+from metrics import cpu_seconds, peak_rss_mb
+from synthetic_corpus import SyntheticCorpus
+
+DEFAULT_SCALES = [10_000, 100_000, 1_000_000]
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+# Relative drop in rows/s that is reported as a regression
+REGRESSION_THRESHOLD = 0.1
+# Stage settings are taken from the pipeline config
+CONFIG = toml.load(os.path.join(ROOT, "data_extraction", "config.toml"))
+
+# A benchmark prepares its input and returns (rows in, function returning rows out)
+Benchmark = Callable[[SyntheticCorpus, int, str], Tuple[int, Callable[[], int]]]
+
+
+def bench_filter_urls(corpus: SyntheticCorpus, n: int, workdir: str):
+    df = corpus.posts(n)
+
+    def run() -> int:
+        config = CONFIG["filter_urls"]
+        valid_df = filter_urls.filter_invalid_domains(df, config["min_domain_count"], config["blacklist_domains"])
+        archive_df, non_archive_df = filter_urls.separate_archive_today_urls(valid_df)
+        return len(archive_df) + len(non_archive_df)
+
+    return len(df), run
+
+
+def bench_extract_documents(corpus: SyntheticCorpus, n: int, workdir: str):
+    df = corpus.posts(n)
+    store_root = os.path.join(workdir, "store")
+    store = HtmlStore(store_root)
+    for post_id, title, url in zip(df.index, df["title"], df["url"]):
+        store.put(post_id, corpus.html(url, title.split("|")[0]))
+    store.close()
+
+    df["store"] = store_root
+    df["source"] = "webarchive"
+    extract_documents.EXTRACTION_CACHE_PATH = os.path.join(workdir, "extraction_cache.sqlite")
+    output_path = os.path.join(workdir, "extracted_documents.jsonl")
+    extractor = get_extractor("newspaper")
+
+    def run() -> int:
+        extract_documents.run_extraction(df, extractor, output_path, multiprocessing.cpu_count())
+        bodies = extract_documents.read_extracted_documents(output_path)
+        extracted = df.loc[df.index.intersection(bodies.index)].copy()
+        extracted["body"] = bodies
+        return len(extract_documents.assemble_syac_dataset(extracted))
+
+    return len(df), run
+
+
+def bench_clean_dataset(corpus: SyntheticCorpus, n: int, workdir: str):
+    df = corpus.dataset(n)
+    profanity_path = os.path.join(workdir, "profanity_targets.tsv")
+    annotated = df.iloc[::100]
+    pd.DataFrame(
+        {"target": annotated["target"], "OK": ["n" if i % 2 else "y" for i in range(len(annotated))]},
+        index=annotated.index,
+    ).to_csv(profanity_path, sep="\t")
+    config = {**CONFIG["clean_dataset"], "profanity_annotations_path": profanity_path}
+
+    def run() -> int:
+        return len(clean_dataset.clean_dataset(df.copy(), config))
+
+    return len(df), run
+
+
+def bench_split_dataset(corpus: SyntheticCorpus, n: int, workdir: str):
+    df = corpus.dataset(n)
+    dataset_path = os.path.join(workdir, "dataset.tsv")
+    ids_path = os.path.join(workdir, "train_val_test_ids.txt")
+    df.to_csv(dataset_path, sep="\t")
+    split_dataset.write_ids(ids_path, *split_dataset.split_df(df))
+    split_paths = {name: os.path.join(workdir, f"{name}.tsv") for name in ("train_path", "val_path", "test_path")}
+
+    def run() -> int:
+        split_dataset.split_dataset(dataset_path, ids_path, ids_path, split_paths)
+        return sum(len(pd.read_csv(path, sep="\t", usecols=[0])) for path in split_paths.values())
+
+    return len(df), run
+
+
+BENCHMARKS: Dict[str, Benchmark] = {
+    "filter_urls": bench_filter_urls,
+    "extract_documents": bench_extract_documents,
+    "clean_dataset": bench_clean_dataset,
+    "split_dataset": bench_split_dataset,
+}
+
+
+def run_benchmark(stage: str, n: int, seed: int, results: multiprocessing.Queue) -> None:
+    """
+    Runs in a fresh process, so the peak RSS only reflects one stage at one scale
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        rows_in, run = BENCHMARKS[stage](SyntheticCorpus(seed), n, workdir)
+
+        cpu_before = cpu_seconds()
+        started_at = time.perf_counter()
+        rows_out = run()
+        seconds = time.perf_counter() - started_at
+
+        results.put(
+            {
+                "stage": stage,
+                "rows": rows_in,
+                "rows_out": rows_out,
+                "seconds": round(seconds, 3),
+                "cpu_seconds": round(cpu_seconds() - cpu_before, 3),
+                "rows_per_second": round(rows_in / seconds, 1),
+                # Includes the generated input
+                "peak_rss_mb": round(peak_rss_mb(), 1),
+            }
+        )
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def find_regressions(results: List[Dict], baseline: List[Dict]) -> List[str]:
+    previous = {(r["stage"], r["rows"]): r for r in baseline}
+    regressions = []
+    for r in results:
+        old = previous.get((r["stage"], r["rows"]))
+        if old and r["rows_per_second"] < old["rows_per_second"] * (1 - REGRESSION_THRESHOLD):
+            regressions.append(
+                f"{r['stage']} at {r['rows']} rows: {old['rows_per_second']} -> {r['rows_per_second']} rows/s"
+            )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks the data_extraction stages on a synthetic corpus")
+    parser.add_argument("--stages", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument("--scales", nargs="+", type=int, default=DEFAULT_SCALES)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, f"benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json"))
+    parser.add_argument("--baseline", help="Earlier results file to check for regressions")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    for stage in args.stages:
+        for n in args.scales:
+            queue = ctx.Queue()
+            process = ctx.Process(target=run_benchmark, args=(stage, n, args.seed, queue))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                print(f"{stage} at {n} rows failed with exit code {process.exitcode}")
+                continue
+
+            result = queue.get()
+            print(f"{stage:<20}{n:>10} rows {result['seconds']:>10.2f}s {result['rows_per_second']:>12} rows/s")
+            results.append(result)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "git_commit": git_commit(),
+                "python": platform.python_version(),
+                "cpu_count": multiprocessing.cpu_count(),
+                "seed": args.seed,
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Wrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f)["results"])
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
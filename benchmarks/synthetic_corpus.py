@@ -0,0 +1,144 @@
+"""
+Deterministic synthetic corpus shaped like the private SYAC data:
+reddit posts with |-separated titles, archive urls, archive-style html pages
+and article bodies of realistic length
+"""
+import random
+import string
+from typing import List
+
+import pandas as pd
+
+WORDS = (
+    "the of and to in is you that it he was for on are as with his they at be this have from or one "
+    "had by word but not what all were we when your can said there use an each which she do how their "
+    "if will up other about out many then them these so some her would make like him into time has look "
+    "two more write go see number no way could people my than first water been call who oil its now find "
+    "long down day did get come made may part study celebrity doctors shocking reason scientists reveal "
+    "secret simple trick actually happened truth behind why never ever really most every new year old"
+).split()
+
+# Domains of the archived urls and their relative frequency, the long tail falls under the
+# 100 posts per domain threshold of filter_urls
+ARCHIVE_DOMAINS = [
+    ("archive.is", 40),
+    ("archive.fo", 10),
+    ("archive.today", 5),
+    ("web.archive.org", 35),
+    ("youtube.com", 2),
+    ("i.redd.it", 2),
+]
+N_RARE_DOMAINS = 500
+
+WAYBACK_CHROME = (
+    '<div id="wm-ipp-base"><div id="wm-ipp"><div id="donato"></div>'
+    "<p>The Wayback Machine - https://web.archive.org/web/{timestamp}/{url}</p>"
+    "<p>{captures} captures between 2015 and 2021, see the calendar of captures for this url</p></div></div>"
+)
+ARCHIVE_TODAY_CHROME = (
+    '<div id="HEADER"><table><tr><td>archive.today webpage capture</td>'
+    "<td>Saved from {url} {timestamp}</td><td>all snapshots from host</td></tr></table></div>"
+)
+
+
+class SyntheticCorpus:
+    def __init__(self, seed: int = 42) -> None:
+        self.rng = random.Random(seed)
+        self.rare_domains = [f"{self.word()}{i}.com" for i in range(N_RARE_DOMAINS)]
+
+    def word(self) -> str:
+        return self.rng.choice(WORDS)
+
+    def words(self, n: int) -> str:
+        return " ".join(self.word() for _ in range(n))
+
+    def post_ids(self, n: int) -> List[str]:
+        ids, seen = [], set()
+        while len(ids) < n:
+            i = "".join(self.rng.choices(string.ascii_lowercase + string.digits, k=6))
+            if i not in seen:
+                seen.add(i)
+                ids.append(i)
+        return ids
+
+    def sentence(self) -> str:
+        return self.words(self.rng.randint(6, 25)).capitalize() + "."
+
+    def paragraphs(self) -> List[str]:
+        # Article bodies are mostly 1000 to 8000 characters long
+        n_paragraphs = self.rng.randint(4, 24)
+        return [" ".join(self.sentence() for _ in range(self.rng.randint(2, 5))) for _ in range(n_paragraphs)]
+
+    def title(self) -> str:
+        title = f"{self.words(self.rng.randint(5, 14)).title()} | {self.words(self.rng.randint(1, 12))}"
+        roll = self.rng.random()
+        if roll < 0.1:
+            title += f" ({self.rng.randint(1, 30)} clicks saved)"
+        elif roll < 0.15:
+            title += " [list in comments]"
+        return title
+
+    def url(self) -> str:
+        if self.rng.random() < 0.05:
+            domain = self.rng.choice(self.rare_domains)
+        else:
+            domains, weights = zip(*ARCHIVE_DOMAINS)
+            domain = self.rng.choices(domains, weights)[0]
+
+        if domain == "web.archive.org":
+            timestamp = f"201{self.rng.randint(5, 9)}{self.rng.randint(10, 12)}{self.rng.randint(10, 28)}120000"
+            return f"https://web.archive.org/web/{timestamp}/http://www.{self.rng.choice(self.rare_domains)}/{self.word()}"
+        if domain.startswith("archive"):
+            return f"http://{domain}/{''.join(self.rng.choices(string.ascii_letters, k=5))}"
+        return f"https://www.{domain}/{self.word()}/{self.word()}"
+
+    def posts(self, n: int) -> pd.DataFrame:
+        """
+        Raw url table like syac_urls_raw
+        """
+        ids = self.post_ids(n)
+        return pd.DataFrame(
+            {"title": [self.title() for _ in ids], "url": [self.url() for _ in ids]},
+            index=pd.Index(ids, name="post_id"),
+        )
+
+    def html(self, url: str, title: str) -> str:
+        """
+        Archive-style page with the Wayback or archive.today chrome around the article
+        """
+        timestamp = f"201{self.rng.randint(5, 9)}-0{self.rng.randint(1, 9)}-1{self.rng.randint(0, 9)}"
+        if "web.archive.org" in url:
+            chrome = WAYBACK_CHROME.format(timestamp=timestamp, url=url, captures=self.rng.randint(1, 500))
+        else:
+            chrome = ARCHIVE_TODAY_CHROME.format(timestamp=timestamp, url=url)
+
+        article = "".join(f"<p>{p}</p>" for p in self.paragraphs())
+        return (
+            f"<html><head><title>{title}</title><script>var tracking = 1;</script></head><body>"
+            f"{chrome}<nav><a href='/'>Home</a> <a href='/news'>News</a></nav>"
+            f"<article><h1>{title}</h1>{article}</article>"
+            f"<footer><p>Copyright {self.word()} media group, all rights reserved.</p></footer>"
+            "</body></html>"
+        )
+
+    def dataset(self, n: int) -> pd.DataFrame:
+        """
+        Extracted dataset like syac_dataset_unprocessed, with a few duplicate and empty bodies
+        """
+        ids = self.post_ids(n)
+        titles = [self.title().split("|") for _ in ids]
+        bodies = ["\n\n".join(self.paragraphs()) for _ in ids]
+
+        for i in range(0, n, 50):
+            bodies[i] = bodies[max(0, i - 7)]
+        for i in range(0, n, 200):
+            bodies[i] = ""
+
+        return pd.DataFrame(
+            {
+                "title": [t[0].strip() for t in titles],
+                "body": bodies,
+                "target": [t[1].strip() for t in titles],
+            },
+            index=pd.Index(ids, name="post_id"),
+        )
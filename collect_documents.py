@@ -0,0 +1,86 @@
+"""
+Downloads the archived pages of the public dataset from web.archive and archive.today
+at the same time, one download backend per archive.
+
+    python collect_documents.py                        # both archives
+    python collect_documents.py --sources webarchive   # a single archive
+    python collect_documents.py --revalidate           # check cached pages for changes
+"""
+import argparse
+import os
+import sys
+from contextlib import ExitStack
+from typing import List, Optional
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "data_extraction"))
+
+from downloads import ArchiveTodayBackend, DownloadJob, WebArchiveBackend, pending_urls, run_downloads
+from html_store import HtmlStore
+from manifest import Manifest
+from warc_store import RollingWarcWriter
+
+SOURCES = ("webarchive", "archivetoday")
+DATA_PATHS = {"webarchive": "data/html/web_archive", "archivetoday": "data/html/archive_today"}
+# "store" writes pages to the html store, "warc" to rolling gzip compressed WARC files
+OUTPUT_FORMAT = "store"
+WARC_PATHS = {"webarchive": "data/warc/webarchive", "archivetoday": "data/warc/archivetoday"}
+# Not the manifest of the data_extraction pipeline: both track the same post ids,
+# but the pages are written to different stores
+MANIFEST_PATH = "data/intermediate/public_manifest.sqlite"
+FETCH_LOG_PATH = "data/intermediate/webarchive_fetch_log.jsonl"
+HTTP_CACHE_PATH = "data/intermediate/http_cache.sqlite"
+
+
+def get_public_df():
+    """
+    Returns the posts of the public reddit syac dataset with their urls
+    """
+    splits = ("train", "validation", "test")
+    return pd.concat((pd.read_csv(f"data/public/{s}_urls.csv", index_col=0) for s in splits))
+
+
+def get_source_df(df: pd.DataFrame, source: str) -> pd.DataFrame:
+    """
+    Returns the posts archived on web.archive, or on archive.today for every other url
+    """
+    is_webarchive = df.url.map(lambda url: "web.archive" in url)
+    return df[is_webarchive] if source == "webarchive" else df[~is_webarchive]
+
+
+def main(sources: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Downloads the archived pages of the public dataset")
+    if sources is None:
+        parser.add_argument("--sources", nargs="+", choices=SOURCES, default=list(SOURCES))
+    parser.add_argument(
+        "--revalidate", action="store_true", help="Revalidate cached web.archive pages instead of serving them as they are"
+    )
+    args = parser.parse_args()
+    if sources is None:
+        sources = args.sources
+
+    manifest = Manifest(MANIFEST_PATH)
+    df = get_public_df()
+
+    with ExitStack() as stack:
+        jobs = []
+        for source in sources:
+            store = HtmlStore(DATA_PATHS[source])
+            warc_writer = None
+            if OUTPUT_FORMAT == "warc":
+                warc_writer = stack.enter_context(RollingWarcWriter(WARC_PATHS[source], source))
+
+            if source == "webarchive":
+                backend = WebArchiveBackend(
+                    store, manifest, FETCH_LOG_PATH, HTTP_CACHE_PATH, warc_writer, args.revalidate
+                )
+            else:
+                backend = ArchiveTodayBackend(store, manifest, warc_writer)
+            jobs.append(DownloadJob(backend, pending_urls(get_source_df(df, source), manifest, source)))
+
+        run_downloads(jobs)
+
+
+if __name__ == "__main__":
+    main()
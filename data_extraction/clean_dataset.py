@@ -1,8 +1,13 @@
+import hashlib
+import multiprocessing
 import re
+from typing import List, Optional, Set, Tuple
 
 import pandas as pd
 
-from common import read_config
+from common import TableWriter, iter_table, read_config, read_table, write_table
+from metrics import StageMetrics
+from near_duplicates import NearDuplicateIndex, write_duplicates
 
 MODULE_NAME = "clean_dataset"
 
@@ -26,38 +31,88 @@ def clean_text_formatting(df):
     return df
 
 
-def remove_abusive_language_data(df, abusive_df_path):
+def read_abusive_ids(abusive_df_path) -> pd.Index:
+    """
+    Reads the ids of the samples annotated as containing abusive language
+    """
+    abusive_df = pd.read_csv(abusive_df_path, sep="\t", index_col=0)
+    return abusive_df[abusive_df["OK"] != "y"].index
+
+
+def remove_abusive_language_data(df, abusive_df_path, abusive_ids=None):
     """
     Removes data from a manually annotated list of samples
     containing labels with abusive language
     """
-    abusive_df = pd.read_csv(abusive_df_path, sep="\t", index_col=0)
+    if abusive_ids is None:
+        abusive_ids = read_abusive_ids(abusive_df_path)
     # FIXME: is errors="ignore" needed?
-    df = df.drop(abusive_df[abusive_df["OK"] != "y"].index, errors="ignore")
+    df = df.drop(abusive_ids, errors="ignore")
     return df
 
 
+# Label cleaning rules, applied in order to every target.
+# Each rule is (pattern, replacement), all patterns are case insensitive
+CLICKS_SAVED_RULES = [
+    # this pattern replaces brackets containing 'click' with surrounding spaces with a space
+    (r"( \[[^\[]*click[^\]]*\] | \([^\(]*click[^\)]*\) )", " "),
+    # this pattern replaces removes brackets containing 'click' with a leading or trailing space
+    (r"( \[[^\[]*click[^\]]*\]|\[[^\[]*click[^\]]*\] | \([^\(]*click[^\)]*\)|\([^\(]*click[^\)]*\) )", ""),
+    (r"([0-9]+\+? )?(saved.*clicks?|clicks?.*saved)", ""),
+    (r"[0-9]+\+? clicks", ""),
+]
+# Every clicks saved rule needs 'click' to match, so labels without it skip all of them
+CLICKS_SAVED_GUARD = re.compile("click", re.IGNORECASE)
+# Matches when a line contains both 'list' and 'comments', like the former
+# lookahead pattern (?=.*list)(?=.*comments) but in a single linear scan
+LIST_IN_COMMENTS_PATTERN = re.compile(r"list[^\n]*comments|comments[^\n]*list", re.IGNORECASE)
+# Frames with fewer rows are cleaned in the main process
+PARALLEL_MIN_ROWS = 100_000
+
+COMPILED_CLICKS_SAVED_RULES = [(re.compile(pattern, re.IGNORECASE), repl) for pattern, repl in CLICKS_SAVED_RULES]
+
+
+def remove_clicks_saved_from_label(label: str) -> str:
+    if not CLICKS_SAVED_GUARD.search(label):
+        return label
+    for pattern, repl in COMPILED_CLICKS_SAVED_RULES:
+        label = pattern.sub(repl, label)
+    return label
+
+
+def clean_label(label: str) -> Optional[str]:
+    """
+    Applies every label rule in one sweep over the label.
+    Returns None when the row should be removed
+    """
+    label = remove_clicks_saved_from_label(label)
+    if LIST_IN_COMMENTS_PATTERN.search(label):
+        return None
+    return label
+
+
+def clean_labels(labels: List[str], n_cores: int = None) -> List[Optional[str]]:
+    """
+    Runs clean_label over every label, in parallel for large frames
+    """
+    if len(labels) < PARALLEL_MIN_ROWS:
+        return [clean_label(label) for label in labels]
+
+    n_cores = n_cores or multiprocessing.cpu_count()
+    chunksize = max(1, len(labels) // (n_cores * 8))
+    with multiprocessing.Pool(n_cores) as pool:
+        return pool.map(clean_label, labels, chunksize)
+
+
 def remove_clicks_saved(df):
     """
     Removes labels describing number of clicks saved.
     TODO: should n > 1 clicks saved be removed all together?
     Reason: most likely a js slideshow
     """
-    
-    pattern_repl = [
-        # this pattern replaces brackets containing 'click' with surrounding spaces with a space
-        (r"( \[[^\[]*click[^\]]*\] | \([^\(]*click[^\)]*\) )", " "),
-        # this pattern replaces removes brackets containing 'click' with a leading or trailing space
-        (r"( \[[^\[]*click[^\]]*\]|\[[^\[]*click[^\]]*\] | \([^\(]*click[^\)]*\)|\([^\(]*click[^\)]*\) )", ""),
-        (r"([0-9]+\+? )?(saved.*clicks?|clicks?.*saved)", ""),
-        (r"[0-9]+\+? clicks", ""),
-    ]
-
-    compiled_pattern_repl = [(re.compile(pattern, re.IGNORECASE), repl) for pattern, repl in pattern_repl]
-    
-    for pattern, repl in compiled_pattern_repl:
-        df.target = df.target.str.replace(pattern, repl)
-    
+    df.target = pd.Series(
+        [remove_clicks_saved_from_label(label) for label in df.target], index=df.index, dtype=df.target.dtype
+    )
     return df
 
 
@@ -65,11 +120,21 @@ def remove_list_in_comments(df):
     """
     Removes rows that contain "list in comments" in the label. Note that the dataset could be expanded to support "list in comments" in the future.  
     """
-    pattern = re.compile(r"(?=.*list)(?=.*comments)", re.IGNORECASE)
-    results = df[df.target.str.contains(pattern)]
+    results = df[df.target.str.contains(LIST_IN_COMMENTS_PATTERN)]
     df = df.drop(results.index)
     return df
-    
+
+
+def clean_targets(df):
+    """
+    Does the work of remove_clicks_saved followed by remove_list_in_comments
+    in a single sweep over the labels
+    """
+    labels = clean_labels(df.target.tolist())
+    df = df.assign(target=pd.Series(labels, index=df.index, dtype=df.target.dtype))
+    df = df.drop(df.index[[label is None for label in labels]])
+    return df
+
 
 def remove_too_short_documents(df, min_len_chars):
     df = df.drop(df[df.body.map(len) < min_len_chars].index)
@@ -85,39 +150,140 @@ def remove_too_long_documents(df, max_len_chars):
     return df
 
 
-def clean_dataset(df, config):
+def remove_near_duplicates(df, near_duplicates: NearDuplicateIndex):
     """
-    Returns a clean dataset
+    Removes articles that are near-duplicates of an earlier kept article,
+    such as the same page archived twice with a different footer
     """
-    df = remove_rows_with_missing_data(df)
+    return df[near_duplicates.add_many(df.index, df.body.tolist())].copy()
+
+
+def record_drop(metrics: Optional[StageMetrics], reason: str, before, after):
+    """
+    Counts the rows removed by a cleaning step and returns the result of the step
+    """
+    if metrics is not None:
+        metrics.drop(reason, len(before) - len(after))
+    return after
+
+
+def clean_dataset(df, config, near_duplicates: NearDuplicateIndex = None, metrics: StageMetrics = None):
+    """
+    Returns a clean dataset.
+    The removed near-duplicates are recorded in `near_duplicates`
+    and the rows removed by each step in `metrics`
+    """
+    df = record_drop(metrics, "missing_data", df, remove_rows_with_missing_data(df))
     df = clean_text_formatting(df)
     df = df.astype("string")
 
-    df = df.drop_duplicates("body")
-    df = remove_too_short_documents(df, 100)
-    df = remove_too_long_documents(df, 50000)
-    df = remove_abusive_language_data(df, config["profanity_annotations_path"])
-    df = remove_clicks_saved(df)
-    df = remove_list_in_comments(df)
+    df = record_drop(metrics, "duplicate_body", df, df.drop_duplicates("body"))
+    if config["remove_near_duplicates"]:
+        index = near_duplicates or NearDuplicateIndex.from_config(config)
+        df = record_drop(metrics, "near_duplicate", df, remove_near_duplicates(df, index))
+    df = record_drop(metrics, "too_short", df, remove_too_short_documents(df, config["min_len_chars"]))
+    df = record_drop(metrics, "too_long", df, remove_too_long_documents(df, config["max_len_chars"]))
+    df = record_drop(
+        metrics, "abusive_language", df, remove_abusive_language_data(df, config["profanity_annotations_path"])
+    )
+    df = record_drop(metrics, "list_in_comments", df, clean_targets(df))
     
     df = clean_text_formatting(df)
-    df = remove_rows_with_missing_data(df)
+    df = record_drop(metrics, "missing_data_after_cleaning", df, remove_rows_with_missing_data(df))
+
+    return df
+
+
+def remove_seen_bodies(df, seen_bodies: Set[bytes]):
+    """
+    Keeps the first row of every body across chunks, like drop_duplicates("body")
+    on the whole dataset. Only a 16 byte digest of each body is remembered
+    """
+    keep = []
+    for body in df.body:
+        digest = hashlib.blake2b(body.encode("UTF8"), digest_size=16).digest()
+        keep.append(digest not in seen_bodies)
+        seen_bodies.add(digest)
+    return df[keep].copy()
+
+
+def clean_chunk(
+    df, config, abusive_ids, seen_bodies: Set[bytes], near_duplicates: NearDuplicateIndex, metrics: StageMetrics = None
+):
+    """
+    Runs the steps of clean_dataset on one chunk of the dataset
+    """
+    df = record_drop(metrics, "missing_data", df, remove_rows_with_missing_data(df))
+    df = clean_text_formatting(df)
+    df = df.astype("string")
+
+    df = record_drop(metrics, "duplicate_body", df, remove_seen_bodies(df, seen_bodies))
+    if config["remove_near_duplicates"]:
+        df = record_drop(metrics, "near_duplicate", df, remove_near_duplicates(df, near_duplicates))
+    df = record_drop(metrics, "too_short", df, remove_too_short_documents(df, config["min_len_chars"]))
+    df = record_drop(metrics, "too_long", df, remove_too_long_documents(df, config["max_len_chars"]))
+    df = record_drop(metrics, "abusive_language", df, remove_abusive_language_data(df, None, abusive_ids))
+    df = record_drop(metrics, "list_in_comments", df, clean_targets(df))
 
+    df = clean_text_formatting(df)
+    df = record_drop(metrics, "missing_data_after_cleaning", df, remove_rows_with_missing_data(df))
     return df
 
 
+def clean_dataset_chunked(
+    input_path, output_path, config, near_duplicates: NearDuplicateIndex = None, metrics: StageMetrics = None
+) -> Tuple[int, int]:
+    """
+    Streaming version of clean_dataset that reads and writes the dataset in chunks
+    of config["chunksize"] rows, so memory use does not grow with the dataset.
+    Gives the same result as clean_dataset as long as the post ids are unique.
+    Returns the number of rows read and written
+    """
+    abusive_ids = read_abusive_ids(config["profanity_annotations_path"])
+    seen_bodies = set()
+    near_duplicates = near_duplicates or NearDuplicateIndex.from_config(config)
+    n_read, n_written = 0, 0
+
+    with TableWriter(output_path) as writer:
+        for df in iter_table(input_path, config["chunksize"]):
+            n_read += len(df)
+            df = clean_chunk(df, config, abusive_ids, seen_bodies, near_duplicates, metrics)
+            writer.write(df)
+            n_written += len(df)
+
+    return n_read, n_written
+
+
 def main():
     config = read_config([MODULE_NAME, "datapaths"])
     module_config = config[MODULE_NAME]
 
-    df_dirty = pd.read_csv(module_config["dirty_dataset_path"], sep="\t", index_col=0)
-    df_clean = clean_dataset(df_dirty, module_config)
+    near_duplicates = NearDuplicateIndex.from_config(module_config)
+
+    with StageMetrics(MODULE_NAME) as metrics:
+        if module_config["chunked"]:
+            n_read, n_written = clean_dataset_chunked(
+                module_config["dirty_dataset_path"], module_config["clean_dataset_path"], module_config,
+                near_duplicates, metrics,
+            )
+        else:
+            df_dirty = read_table(module_config["dirty_dataset_path"])
+            df_clean = clean_dataset(df_dirty, module_config, near_duplicates, metrics)
+
+            assert df_clean.isna().any(axis=1).any() == False
 
-    assert df_clean.isna().any(axis=1).any() == False
+            write_table(df_clean, module_config["clean_dataset_path"])
+            n_read, n_written = len(df_dirty), len(df_clean)
 
-    print("Removed ", len(df_dirty) - len(df_clean), "rows from dataset")
+        metrics.rows_in, metrics.rows_out = n_read, n_written
+        print("Removed ", n_read - n_written, "rows from dataset")
 
-    df_clean.to_csv(module_config["clean_dataset_path"], sep="\t")
+    if module_config["remove_near_duplicates"]:
+        write_duplicates(module_config["near_duplicates_path"], near_duplicates.duplicates)
+        print(
+            "Removed ", len(near_duplicates.duplicates), "near-duplicates in",
+            len(near_duplicates.clusters()), "clusters, see", module_config["near_duplicates_path"],
+        )
     
 
 if __name__ == "__main__":
@@ -1,9 +1,16 @@
-from typing import Dict, List
+import os
+from typing import Dict, Iterator, List, Optional
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
 import toml
 
 CONFIG_PATH = "config.toml"
+TABLE_FORMATS = (".parquet", ".arrow", ".tsv")
+# Compression of the Parquet and Arrow tables
+COMPRESSION = "zstd"
 
 
 def read_config(fields: List[str]) -> Dict[str, str]:
@@ -23,10 +30,122 @@ def read_tsv(path):
     return pd.read_csv(path, sep="\t", index_col=0)
 
 
-def update_preprocessing_log(data_size, task_name) -> None:
+def table_format(path: str) -> str:
     """
-    A function to keep track of the lost data in each data preprocessing step
+    Storage format of a dataset table, given by the file extension:
+    .parquet, .arrow (Arrow IPC) or .tsv
     """
-    preprocessing_log = pd.read_csv("../data/intermediate/preprocessing_log.csv", index_col=0)
-    preprocessing_log.loc[task_name]["Samples"] = data_size
-    preprocessing_log.to_csv("../data/intermediate/preprocessing_log.csv")
+    extension = os.path.splitext(path)[1]
+    if extension not in TABLE_FORMATS:
+        raise ValueError(f"Unknown table format {extension}, use one of {', '.join(TABLE_FORMATS)}")
+    return extension
+
+
+def index_columns(schema: pa.Schema) -> List[str]:
+    """
+    Columns holding the dataframe index of a table written by write_table
+    """
+    metadata = schema.pandas_metadata or {}
+    return [c for c in metadata.get("index_columns", []) if isinstance(c, str)]
+
+
+def read_arrow(path: str, columns: Optional[List[str]] = None) -> pa.Table:
+    """
+    Memory-maps an Arrow IPC table, keeping the index columns when projecting
+    """
+    if columns is not None:
+        columns = index_columns(feather.read_table(path, columns=[], memory_map=True).schema) + columns
+    return feather.read_table(path, columns=columns, memory_map=True)
+
+
+def read_table(path: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Reads a dataset table indexed by post id, only loading `columns` when given.
+    Parquet and Arrow files are memory-mapped instead of read into a buffer first
+    """
+    extension = table_format(path)
+    if extension == ".tsv":
+        df = pd.read_csv(path, sep="\t", index_col=0, dtype=str)
+        return df if columns is None else df[columns]
+
+    if extension == ".parquet":
+        return pd.read_parquet(path, columns=columns, memory_map=True)
+
+    return read_arrow(path, columns).to_pandas()
+
+
+def iter_table(path: str, chunksize: int, columns: Optional[List[str]] = None) -> Iterator[pd.DataFrame]:
+    """
+    Reads a dataset table in chunks of at most `chunksize` rows
+    """
+    extension = table_format(path)
+    if extension == ".tsv":
+        for df in pd.read_csv(path, sep="\t", index_col=0, dtype=str, chunksize=chunksize):
+            yield df if columns is None else df[columns]
+        return
+
+    if extension == ".parquet":
+        parquet_file = pq.ParquetFile(path, memory_map=True)
+        schema = parquet_file.schema_arrow
+        batches = parquet_file.iter_batches(
+            chunksize, columns=None if columns is None else index_columns(schema) + columns
+        )
+    else:
+        table = read_arrow(path, columns)
+        schema = table.schema
+        batches = table.to_batches(chunksize)
+
+    for batch in batches:
+        yield pa.Table.from_batches([batch]).replace_schema_metadata(schema.metadata).to_pandas()
+
+
+def write_table(df: pd.DataFrame, path: str) -> None:
+    """
+    Writes a dataset table, Parquet and Arrow files are zstd compressed
+    and keep the column types
+    """
+    extension = table_format(path)
+    if extension == ".tsv":
+        df.to_csv(path, sep="\t")
+    elif extension == ".parquet":
+        df.to_parquet(path, compression=COMPRESSION)
+    else:
+        feather.write_feather(pa.Table.from_pandas(df), path, compression=COMPRESSION)
+
+
+class TableWriter:
+    """
+    Writes a dataset table in chunks, all chunks must have the same columns and types
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.format = table_format(path)
+        self.writer = None
+        self.n_chunks = 0
+
+    def write(self, df: pd.DataFrame) -> None:
+        if self.format == ".tsv":
+            df.to_csv(self.path, sep="\t", mode="w" if self.n_chunks == 0 else "a", header=self.n_chunks == 0)
+        else:
+            table = pa.Table.from_pandas(df)
+            if self.writer is None:
+                self.schema = table.schema
+                if self.format == ".parquet":
+                    self.writer = pq.ParquetWriter(self.path, self.schema, compression=COMPRESSION)
+                else:
+                    self.writer = pa.ipc.new_file(
+                        self.path, self.schema, options=pa.ipc.IpcWriteOptions(compression=COMPRESSION)
+                    )
+            self.writer.write_table(table.cast(self.schema))
+        self.n_chunks += 1
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+
+    def __enter__(self) -> "TableWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
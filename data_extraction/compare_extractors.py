@@ -0,0 +1,115 @@
+"""
+Runs every extractor backend over the same sample of html pages and reports
+docs/sec, peak memory, failure rate and text overlap with the newspaper output
+"""
+import argparse
+import multiprocessing
+import random
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from extractors import EXTRACTION_ERRORS, EXTRACTORS, NewspaperExtractor, get_extractor
+from html_store import HtmlStore
+from manifest import Manifest
+from metrics import peak_rss_mb
+
+STORE_PATHS = {
+    "webarchive": "dataset_raw/webarchive",
+    "archivetoday": "dataset_raw/archivetoday",
+}
+
+
+def load_sample(sample_size: int, seed: int = 42) -> List[str]:
+    """
+    Reads a random sample of downloaded pages from the html stores
+    """
+    manifest = Manifest()
+    random.seed(seed)
+
+    pages = []
+    for source, store_path in STORE_PATHS.items():
+        ids = manifest.downloaded_ids(source)
+        store = HtmlStore(store_path)
+        for doc_id in random.sample(ids, min(sample_size // len(STORE_PATHS), len(ids))):
+            try:
+                pages.append(store.get_text(doc_id))
+            except (KeyError, UnicodeDecodeError):
+                continue
+    return pages
+
+
+def run_extractor(name: str, pages: List[str]) -> Dict:
+    """
+    Runs in a fresh process, so the peak RSS only reflects this extractor
+    """
+    extractor = get_extractor(name)
+    rss_before = peak_rss_mb()
+
+    texts = []
+    started_at = time.perf_counter()
+    for page in pages:
+        try:
+            texts.append(extractor.extract(page))
+        except EXTRACTION_ERRORS:
+            texts.append(None)
+    elapsed = time.perf_counter() - started_at
+
+    return {"texts": texts, "seconds": elapsed, "peak_rss_mb": peak_rss_mb() - rss_before}
+
+
+def token_f1(text: Optional[str], reference: Optional[str]) -> Optional[float]:
+    """
+    Bag of words F1 between an extracted text and the reference text
+    """
+    if text is None or reference is None:
+        return None
+
+    tokens, reference_tokens = Counter(text.split()), Counter(reference.split())
+    overlap = sum((tokens & reference_tokens).values())
+    if overlap == 0:
+        return 0.0
+
+    precision = overlap / sum(tokens.values())
+    recall = overlap / sum(reference_tokens.values())
+    return 2 * precision * recall / (precision + recall)
+
+
+def compare_extractors(pages: List[str]) -> pd.DataFrame:
+    ctx = multiprocessing.get_context("spawn")
+    runs = {}
+    for name in EXTRACTORS:
+        with ctx.Pool(1) as pool:
+            runs[name] = pool.apply(run_extractor, (name, pages))
+
+    reference = runs[NewspaperExtractor.name]["texts"]
+    rows = []
+    for name, run in runs.items():
+        f1_scores = [token_f1(t, r) for t, r in zip(run["texts"], reference)]
+        f1_scores = [f for f in f1_scores if f is not None]
+        rows.append(
+            {
+                "extractor": name,
+                "docs_per_second": len(pages) / run["seconds"] if run["seconds"] else float("inf"),
+                "peak_rss_mb": round(run["peak_rss_mb"], 1),
+                "failure_rate": sum(t is None for t in run["texts"]) / len(pages),
+                "mean_f1_vs_newspaper": sum(f1_scores) / len(f1_scores) if f1_scores else None,
+            }
+        )
+    return pd.DataFrame(rows).set_index("extractor")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sample-size", type=int, default=500)
+    args = parser.parse_args()
+
+    pages = load_sample(args.sample_size)
+    print(f"Comparing extractors on {len(pages)} pages")
+    print(compare_extractors(pages).to_string())
+
+
+if __name__ == "__main__":
+    main()
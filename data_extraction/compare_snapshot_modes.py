@@ -0,0 +1,62 @@
+"""
+Measures bytes transferred and extraction time of the raw and rewritten
+Wayback snapshot modes on a sample of the web.archive urls
+"""
+import argparse
+import time
+
+import newspaper
+import pandas as pd
+
+from common import read_table
+from fetcher import FetchResult, fetch_all
+from wayback import RAW_MODE, REWRITTEN_MODE, snapshot_urls
+
+WEB_ARCHIVE_URLS_PATH = "../data/intermediate/webarchive_urls.parquet"
+
+
+def measure_mode(urls: pd.Series, mode: str) -> dict:
+    pages = {}
+
+    def collect(result: FetchResult) -> None:
+        if result.status == 200:
+            pages[result.id] = result.content
+
+    started_at = time.perf_counter()
+    fetch_all(snapshot_urls(urls, mode).to_dict(), collect)
+    fetch_time = time.perf_counter() - started_at
+
+    n_failed = 0
+    started_at = time.perf_counter()
+    for content in pages.values():
+        try:
+            newspaper.fulltext(content.decode("UTF8"))
+        except (AttributeError, UnicodeDecodeError):
+            n_failed += 1
+    extraction_time = time.perf_counter() - started_at
+
+    return {
+        "mode": mode,
+        "pages": len(pages),
+        "bytes": sum(map(len, pages.values())),
+        "fetch_seconds": round(fetch_time, 2),
+        "extraction_seconds": round(extraction_time, 2),
+        "extraction_failures": n_failed,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sample-size", type=int, default=200)
+    parser.add_argument("--urls", default=WEB_ARCHIVE_URLS_PATH)
+    args = parser.parse_args()
+
+    data = read_table(args.urls)
+    urls = data["url"].sample(min(args.sample_size, len(data)), random_state=42)
+
+    results = pd.DataFrame([measure_mode(urls, mode) for mode in (REWRITTEN_MODE, RAW_MODE)])
+    print(results.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,78 @@
+"""
+Adds the url of every post to the train, validation and test sets.
+Urls missing from the filtered url tables are looked up on reddit
+"""
+import csv
+import os
+from typing import Dict, Iterable, List
+
+import dotenv
 import pandas as pd
 import praw
-import dotenv
 
-CREDS = dotenv.dotenv_values(".env")
-session = praw.Reddit(**CREDS)
+from common import read_table
+
+SPLITS = ("train", "validation", "test")
+URL_TABLE_PATHS = ("../data/intermediate/archivetoday_urls.parquet", "../data/intermediate/webarchive_urls.parquet")
+# Urls resolved on reddit, an empty url marks a post that could not be found
+RESOLVED_URLS_PATH = "../data/intermediate/resolved_urls.tsv"
+# Largest number of fullnames reddit accepts in one info request
+INFO_BATCH_SIZE = 100
+
+
+def read_resolved_urls(path: str) -> Dict[str, str]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="UTF8", newline="") as f:
+        return {post_id: url for post_id, url in csv.reader(f, delimiter="\t")}
+
+
+def resolve_urls(session, ids: Iterable[str], cache_path: str = RESOLVED_URLS_PATH) -> Dict[str, str]:
+    """
+    Returns the url of every post id, with one info request per hundred posts
+    that are not in the on-disk cache. Every batch is appended to the cache as
+    soon as it is resolved
+    """
+    resolved = read_resolved_urls(cache_path)
+    missing: List[str] = sorted(set(ids) - set(resolved))
+
+    with open(cache_path, "a", encoding="UTF8", newline="") as f:
+        writer = csv.writer(f, delimiter="\t")
+        for start in range(0, len(missing), INFO_BATCH_SIZE):
+            batch = missing[start : start + INFO_BATCH_SIZE]
+            urls = {s.id: s.url for s in session.info(fullnames=[f"t3_{i}" for i in batch])}
+            rows = [(i, urls.get(i, "")) for i in batch]
+            writer.writerows(rows)
+            f.flush()
+            resolved.update(rows)
 
+    return {i: resolved[i] for i in ids}
 
-archive_today_urls = pd.read_csv("../data/intermediate/archivetoday_urls.tsv", sep="\t", index_col=0)
-web_archive_urls = pd.read_csv("../data/intermediate/webarchive_urls.tsv", sep="\t", index_col=0)
 
-full_url_df = pd.concat((archive_today_urls, web_archive_urls))
-# requests_urls_raw = pd.read_csv("../../data/intermediate/url_data_raw.tsv", sep="\t", index_col=0)
-# full_url_df = requests_urls_raw
+def main():
+    creds = dotenv.dotenv_values(".env")
+    session = praw.Reddit(**creds)
 
-for s in "train", "validation", "test":
-    df = pd.read_csv("data/" + s + ".csv", index_col=0)
+    full_url_df = pd.concat([read_table(path, ["url"]) for path in URL_TABLE_PATHS])
+    # requests_urls_raw = pd.read_csv("../../data/intermediate/url_data_raw.tsv", sep="\t", index_col=0)
+    # full_url_df = requests_urls_raw
 
-    id_diff = set(df.index) - set(full_url_df.index)
-    df["url"] = full_url_df["url"]
+    for s in SPLITS:
+        df = pd.read_csv("data/" + s + ".csv", index_col=0)
 
+        id_diff = set(df.index) - set(full_url_df.index)
+        df["url"] = full_url_df["url"]
 
-    if id_diff:
-        remaining_urls = {i: session.submission(id=i).url for i in id_diff}
-        for i, url in remaining_urls.items():
-            print(i)
-            df.loc[i]["url"] = url
+        if id_diff:
+            for i, url in resolve_urls(session, id_diff).items():
+                if not url:
+                    print(f"Could not resolve the url of {i}")
+                    continue
+                df.loc[i, "url"] = url
 
-    print(df.isna().any())
-    df[["title", "url", "target"]].to_csv(s + "_urls.csv")
+        print(df.isna().any())
+        df[["title", "url", "target"]].to_csv(s + "_urls.csv")
 
-# train = pd.read_csv("train.csv", index_col=0)
-# validation = pd.read_csv("validation.csv", index_col=0)
-# test = pd.read_csv("test.csv", index_col=0)
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Downloads the archived pages of the filtered urls from web.archive and archive.today
+at the same time, one download backend per archive.
+
+    python download_documents.py                        # both archives
+    python download_documents.py --sources webarchive   # a single archive
+    python download_documents.py --revalidate           # check cached pages for changes
+"""
+import argparse
+from contextlib import ExitStack
+from typing import Optional
+
+from common import read_table
+from downloads import ArchiveTodayBackend, DownloadJob, WebArchiveBackend, pending_urls, run_downloads
+from html_store import HtmlStore
+from manifest import Manifest
+from metrics import StageMetrics, record_download_metrics
+from warc_store import RollingWarcWriter
+
+TASK_NAME = "download_documents"
+MANIFEST_PATH = "../data/intermediate/manifest.sqlite"
+FETCH_LOG_PATH = "../data/intermediate/webarchive_fetch_log.jsonl"
+HTTP_CACHE_PATH = "../data/intermediate/http_cache.sqlite"
+URL_PATHS = {
+    "webarchive": "../data/intermediate/webarchive_urls.parquet",
+    "archivetoday": "../data/intermediate/archivetoday_urls.parquet",
+}
+DATA_PATHS = {
+    "webarchive": "dataset_raw/webarchive",
+    "archivetoday": "dataset_raw/archivetoday",
+}
+# "store" writes pages to the html store, "warc" to rolling gzip compressed WARC files,
+# which extract_documents reads with INPUT_FORMAT = "warc"
+OUTPUT_FORMAT = "store"
+WARC_PATHS = {
+    "webarchive": "../data/warc/webarchive",
+    "archivetoday": "../data/warc/archivetoday",
+}
+
+
+def make_backend(
+    source: str, manifest: Manifest, warc_writer: Optional[RollingWarcWriter] = None, revalidate: bool = False
+):
+    store = HtmlStore(DATA_PATHS[source])
+    if source == "webarchive":
+        return WebArchiveBackend(store, manifest, FETCH_LOG_PATH, HTTP_CACHE_PATH, warc_writer, revalidate)
+    return ArchiveTodayBackend(store, manifest, warc_writer)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Downloads the archived pages of the filtered urls")
+    parser.add_argument("--sources", nargs="+", choices=list(URL_PATHS), default=list(URL_PATHS))
+    parser.add_argument(
+        "--revalidate", action="store_true", help="Revalidate cached web.archive pages instead of serving them as they are"
+    )
+    args = parser.parse_args()
+
+    with StageMetrics(TASK_NAME) as metrics, ExitStack() as stack:
+        manifest = Manifest(MANIFEST_PATH)
+        jobs = []
+        for source in args.sources:
+            warc_writer = None
+            if OUTPUT_FORMAT == "warc":
+                warc_writer = stack.enter_context(RollingWarcWriter(WARC_PATHS[source], source))
+            data = pending_urls(read_table(URL_PATHS[source], ["url"]), manifest, source)
+            jobs.append(DownloadJob(make_backend(source, manifest, warc_writer, args.revalidate), data))
+        metrics.rows_in = sum(len(job.data) for job in jobs)
+
+        try:
+            run_downloads(jobs)
+        finally:
+            for job in jobs:
+                record_download_metrics(metrics, manifest, job.backend.source, job.data.index)
+
+
+if __name__ == "__main__":
+    main()
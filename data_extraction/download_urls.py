@@ -1,17 +1,34 @@
+import csv
+import glob
+import io
+import json
 import logging
+import multiprocessing
 import os
-from typing import Any, Dict
+import re
+import tempfile
+from typing import Any, Dict, Iterator, NamedTuple, Optional, Tuple
 
 # create module containing this yourself
 import dotenv
 import pandas as pd
 import praw
 import psaw
+import zstandard
+
+from common import TableWriter, read_config, read_table, write_table
+from metrics import StageMetrics
 
 CREDS = dotenv.dotenv_values(".env")
 
+MODULE_NAME = "download_urls"
 SUBREDDIT_NAME = "savedyouaclick"
-N_CALLS = 1
+RAW_URLS_PATH = "../data/intermediate/syac_urls_raw.parquet"
+HIGH_WATER_MARK_PATH = "../data/intermediate/praw_high_water_mark.json"
+# Pushshift dumps are compressed with a long distance window
+DUMP_MAX_WINDOW_SIZE = 2**31
+# Rows per chunk when merging the posts of the dumps into the raw url table
+MERGE_CHUNK_SIZE = 100_000
 
 
 def fetch_url_dataset(include_praw=False) -> Dict[str, Any]:
@@ -22,29 +39,83 @@ def fetch_url_dataset(include_praw=False) -> Dict[str, Any]:
     post_dict = fetch_url_dataset_psaw(session)
 
     if include_praw:
-        post_dict.update(fetch_url_dataset_praw(session, N_CALLS))
+        post_dict.update(fetch_url_dataset_praw(session)[0])
 
     return post_dict
 
 
-def fetch_url_dataset_praw(reddit_session, n_calls=1) -> Dict[str, Any]:
+class HighWaterMark(NamedTuple):
     """
-    Fetches urls using the praw API
-    The praw API limits your requested posts to a thousand, so repeated calls are made to increase number of posts
-
-    # TODO: implement sliding window over date
+    Newest post seen by the praw fetcher
     """
-    subreddit = reddit_session.subreddit(SUBREDDIT_NAME)
 
+    id: str
+    created_utc: float
+
+
+def read_high_water_mark(path: str) -> Optional[HighWaterMark]:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return HighWaterMark(**json.load(f))
+
+
+def write_high_water_mark(path: str, mark: HighWaterMark) -> None:
+    with open(path, "w") as f:
+        json.dump(mark._asdict(), f)
+
+
+def fetch_url_dataset_praw(
+    reddit_session, since: Optional[HighWaterMark] = None, subreddit_name: str = SUBREDDIT_NAME
+) -> Tuple[Dict[str, Any], Optional[HighWaterMark]]:
+    """
+    Fetches the posts newer than the high water mark using the praw API, and returns them
+    with the new mark. The listing is newest first and fetched lazily a hundred posts per call,
+    so it stops after the first page reaching the mark.
+    Without a mark, this is the full listing, which the praw API limits to a thousand posts
+    """
     post_dict = {}
+    newest = since
 
-    for i in range(n_calls):
-        post_dict_len = len(post_dict)
-        postit = subreddit.new(limit=None)
-        post_dict.update((p.id, p) for p in postit if p.is_robot_indexable)
-        logging.info(f" Increased number of posts by {len(post_dict) - post_dict_len}")
+    for p in reddit_session.subreddit(subreddit_name).new(limit=None):
+        if since is not None and (p.id == since.id or p.created_utc < since.created_utc):
+            break
+        if newest is None or p.created_utc > newest.created_utc:
+            newest = HighWaterMark(p.id, p.created_utc)
+        if p.is_robot_indexable:
+            post_dict[p.id] = p
 
-    return post_dict
+    logging.info(f" Retreived {len(post_dict)} new posts")
+    return post_dict, newest
+
+
+def write_raw_urls(post_dict: Dict[str, Any], path: str) -> int:
+    """
+    Adds the posts that are not in the raw url table yet to the table,
+    creating it when needed, and returns the number of rows in the table
+    """
+    new_df = pd.DataFrame(
+        {"title": [p.title for p in post_dict.values()], "url": [p.url for p in post_dict.values()]},
+        index=pd.Index(list(post_dict.keys()), name="id"),
+    )
+    if os.path.exists(path):
+        raw_df = read_table(path)
+        new_df = pd.concat((raw_df, new_df[~new_df.index.isin(raw_df.index)]))
+
+    write_table(new_df, path)
+    return len(new_df)
+
+
+def update_url_dataset_praw(reddit_session, raw_urls_path: str, mark_path: str, subreddit_name: str) -> int:
+    """
+    Merges the posts made since the last update into the raw url table
+    """
+    post_dict, mark = fetch_url_dataset_praw(reddit_session, read_high_water_mark(mark_path), subreddit_name)
+    n_posts = write_raw_urls(post_dict, raw_urls_path)
+    # The mark moves only once the posts are stored, so a failed update is retried in full
+    if mark is not None:
+        write_high_water_mark(mark_path, mark)
+    return n_posts
 
 
 def fetch_url_dataset_psaw(session) -> Dict[str, Any]:
@@ -58,44 +129,101 @@ def fetch_url_dataset_psaw(session) -> Dict[str, Any]:
     return data
 
 
-def create_preprocessing_log(data_size) -> None:
+def iter_dump_lines(path: str) -> Iterator[bytes]:
+    """
+    Streams the lines of a zstd compressed NDJSON dump without decompressing it to disk
+    """
+    with open(path, "rb") as f:
+        decompressor = zstandard.ZstdDecompressor(max_window_size=DUMP_MAX_WINDOW_SIZE)
+        with decompressor.stream_reader(f) as reader:
+            yield from io.BufferedReader(reader)
+
+
+def extract_dump_posts(task: Tuple[str, str, str]) -> Tuple[str, int]:
     """
-    Creates a dataframe describing how much data is discarded
-    in the pre-processing
+    Writes the id, title and url of the robot indexable posts of the subreddit in a dump
+    to a TSV part file in `part_dir`, and returns the part path and the number of posts.
+    Dumps from before is_robot_indexable was recorded keep every post
     """
-    preprocessing_log = pd.DataFrame(
-        {"Samples": [data_size, 0, 0, 0]},
-        index=[
-            "download_urls",
-            "filter_urls",
-            "download_documents",
-            "extract_documents",
-        ],
+    dump_path, subreddit, part_dir = task
+    # Skips json parsing for the vast majority of lines, which are about other subreddits
+    prefilter = re.compile(re.escape(subreddit.encode("UTF8")), re.IGNORECASE)
+    part_path = os.path.join(part_dir, os.path.basename(dump_path) + ".tsv")
+
+    n_posts = 0
+    with open(part_path, "w", encoding="UTF8", newline="") as f:
+        writer = csv.writer(f, delimiter="\t")
+        for line in iter_dump_lines(dump_path):
+            if not prefilter.search(line):
+                continue
+            try:
+                post = json.loads(line)
+            except json.JSONDecodeError:
+                logging.warning(f" Skipping malformed line in {dump_path}")
+                continue
+            if (post.get("subreddit") or "").lower() != subreddit.lower() or not post.get("is_robot_indexable", True):
+                continue
+            writer.writerow((post["id"], post.get("title", ""), post.get("url", "")))
+            n_posts += 1
+
+    logging.info(f" Found {n_posts} posts in {dump_path}")
+    return part_path, n_posts
+
+
+def posts_to_df(rows) -> pd.DataFrame:
+    return pd.DataFrame(
+        [row[1:] for row in rows], index=pd.Index([row[0] for row in rows], name="id"), columns=["title", "url"], dtype=str
     )
 
-    preprocessing_log.to_csv("../data/intermediate/preprocessing_log.csv")
+
+def ingest_dumps(dump_paths, subreddit: str, output_path: str, n_cores: int) -> int:
+    """
+    Extracts the posts of the subreddit from Pushshift submission dumps into the raw url table,
+    one dump per process. Posts found in several dumps are kept once
+    """
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(output_path)) as part_dir:
+        tasks = [(path, subreddit, part_dir) for path in dump_paths]
+        with multiprocessing.Pool(min(n_cores, len(tasks) or 1)) as pool:
+            parts = pool.map(extract_dump_posts, tasks, chunksize=1)
+
+        seen_ids = set()
+        rows = []
+        with TableWriter(output_path) as writer:
+            for part_path, _ in parts:
+                with open(part_path, "r", encoding="UTF8", newline="") as part:
+                    for row in csv.reader(part, delimiter="\t"):
+                        if row[0] not in seen_ids:
+                            seen_ids.add(row[0])
+                            rows.append(row)
+                        if len(rows) == MERGE_CHUNK_SIZE:
+                            writer.write(posts_to_df(rows))
+                            rows = []
+            if rows or not seen_ids:
+                writer.write(posts_to_df(rows))
+
+    logging.info(f" Retreived {len(seen_ids)} posts from {len(dump_paths)} dumps")
+    return len(seen_ids)
 
 
 def main():
     if not os.path.exists("../data/intermediate"):
         os.mkdir("../data/intermediate")
 
-    post_dict = fetch_url_dataset()
-
-    raw_dataset = pd.DataFrame(
-        {
-            "post_title": [p.title for p in post_dict.values()],
-            "url": [p.url for p in post_dict.values()],
-        },
-        index=post_dict.keys(),
-    )
-
-    raw_dataset.to_csv("../data/intermediate/syac_urls_raw.csv")
-
-    with open("posts.pickle", "wb+") as f:
-        f.write()
-
-    create_preprocessing_log(len(raw_dataset))
+    config = read_config([MODULE_NAME])[MODULE_NAME]
+    with StageMetrics(MODULE_NAME) as metrics:
+        if config["source"] == "dumps":
+            dump_paths = sorted(glob.glob(config["dump_paths"]))
+            n_posts = ingest_dumps(
+                dump_paths, config["subreddit"], RAW_URLS_PATH, config["n_cores"] or multiprocessing.cpu_count()
+            )
+        elif config["source"] == "praw":
+            n_posts = update_url_dataset_praw(
+                praw.Reddit(**CREDS), RAW_URLS_PATH, HIGH_WATER_MARK_PATH, config["subreddit"]
+            )
+        else:
+            post_dict = fetch_url_dataset()
+            n_posts = write_raw_urls(post_dict, RAW_URLS_PATH)
+        metrics.rows_out = n_posts
 
 
 if __name__ == "__main__":
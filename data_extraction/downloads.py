@@ -0,0 +1,321 @@
+"""
+Download subsystem for the archived pages, with one backend per archive.
+
+Every backend keeps its own queue and rate budget for its host: web.archive pages go
+through the asyncio fetch engine, archive.today pages through a plain HTTP fast path
+and then the selenium driver pool. Failed requests are retried from the backend's queue,
+interleaved with the pages that are still waiting. run_downloads runs the backends at
+the same time, so downloading both archives takes about as long as the slower one.
+"""
+import concurrent.futures
+import logging
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+import pandas as pd
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+
+from driver_pool import run_driver_pool
+from fetcher import FetchLog, FetchResult, FetchStats, fetch_all, host_of
+from html_store import HtmlStore
+from http_cache import HttpCache
+from manifest import Manifest
+from warc_store import RollingWarcWriter
+from wayback import CDX_ENDPOINT, RAW_MODE, resolve_snapshots, snapshot_urls
+
+# web.archive
+WEBARCHIVE_CONCURRENCY = 8
+WEBARCHIVE_REQUESTS_PER_SECOND = 2.0
+# RAW_MODE fetches the archived bytes (id_ urls), REWRITTEN_MODE the page with the Wayback toolbar
+SNAPSHOT_MODE = RAW_MODE
+# Resolve every url to its closest successful capture before downloading
+RESOLVE_WITH_CDX = True
+CDX_CONCURRENCY = 4
+CDX_REQUESTS_PER_SECOND = 1.0
+HTTP_CACHE_MAX_BYTES = 20 * 1024**3
+# Archived snapshots never change, but new captures can change the closest one
+CDX_CACHE_TTL = 30 * 24 * 3600
+
+# archive.today
+N_DRIVERS = 4
+ARCHIVETODAY_REQUESTS_PER_SECOND = 1.0
+MAX_PAGES_PER_DRIVER = 200
+# Tries of a page in the driver pool, retries are spaced at least RETRY_DELAY seconds apart
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 30.0
+# Plain HTTP fast path, selenium is only used for the pages it fails on
+USE_HTTP_FAST_PATH = True
+HTTP_CONCURRENCY = 4
+HTTP_MAX_REQUESTS_PER_SECOND = 2.0
+HTTP_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36",
+}
+# Mirrors of the same service, which share one rate budget
+ARCHIVETODAY_MIRRORS = {"archive.today", "archive.is", "archive.fo", "archive.ph", "archive.li", "archive.md", "archive.vn"}
+MIN_PAGE_LENGTH = 2000
+captcha_content = "Completing the CAPTCHA proves you are a human"
+
+chrome_options = Options()
+chrome_options.add_argument("--headless")
+# This line disables javascript
+chrome_options.add_experimental_option("prefs", {'profile.managed_default_content_settings.javascript': 2})
+
+
+def pending_urls(data: pd.DataFrame, manifest: Manifest, source: str) -> pd.DataFrame:
+    """
+    Adds the urls to the manifest and returns the ones that still have to be downloaded
+    """
+    manifest.add_pending(source, data["url"].to_dict())
+    return data.loc[data.index.intersection(manifest.pending_ids(source))]
+
+
+class DownloadBackend:
+    """
+    Downloads the pages of one archive, writing them to `store`, or to `warc_writer`
+    if given, and their state to the manifest
+    """
+
+    source = ""
+
+    def __init__(
+        self, store: HtmlStore, manifest: Manifest, warc_writer: Optional[RollingWarcWriter] = None
+    ) -> None:
+        self.store = store
+        self.manifest = manifest
+        self.warc_writer = warc_writer
+
+    def pending(self, data: pd.DataFrame) -> pd.DataFrame:
+        return data.loc[data.index.intersection(self.manifest.pending_ids(self.source))]
+
+    def download(self, data: pd.DataFrame) -> None:
+        raise NotImplementedError
+
+
+class WebArchiveBackend(DownloadBackend):
+    source = "webarchive"
+
+    def __init__(
+        self,
+        store: HtmlStore,
+        manifest: Manifest,
+        fetch_log_path: str,
+        http_cache_path: str,
+        warc_writer: Optional[RollingWarcWriter] = None,
+        revalidate: bool = False,
+    ) -> None:
+        super().__init__(store, manifest, warc_writer)
+        self.fetch_log_path = fetch_log_path
+        self.http_cache_path = http_cache_path
+        # Send a conditional request for every cached page instead of serving it as it is
+        self.revalidate = revalidate
+
+    def resolve(self, data: pd.DataFrame, cache: Optional[HttpCache] = None) -> pd.DataFrame:
+        """
+        Pre-pass replacing the urls with their closest successful capture from the CDX API.
+        Documents without any successful capture are marked as failed and left out
+        """
+        resolved = resolve_snapshots(
+            data["url"].to_dict(),
+            endpoint=CDX_ENDPOINT,
+            concurrency=CDX_CONCURRENCY,
+            rate=CDX_REQUESTS_PER_SECOND,
+            cache=cache,
+        )
+
+        missing = data.index.difference(list(resolved))
+        self.manifest.mark_many(missing, "failed", "No successful capture in the CDX index")
+
+        data = data.drop(missing)
+        data["url"] = pd.Series(resolved)
+        return data
+
+    def fetch(self, data: pd.DataFrame, cache: Optional[HttpCache] = None) -> FetchStats:
+        """
+        Uses the asyncio fetch engine to retrieve responses.
+        Each page is written as soon as it arrives and only its metadata is kept,
+        in the append-only fetch log. Pages already in `cache` are not downloaded again,
+        or only downloaded again if they changed when the backend revalidates
+        """
+
+        with FetchLog(self.fetch_log_path) as fetch_log:
+
+            def save_response(result: FetchResult) -> None:
+                if self.warc_writer is not None:
+                    self.warc_writer.write_response(
+                        result.id, result.final_url, result.status, result.headers, result.content
+                    )
+
+                if result.status == 200:
+                    if self.warc_writer is None:
+                        self.store.put(result.id, result.content)
+                    self.manifest.mark(result.id, "fetched")
+                else:
+                    self.manifest.mark(result.id, "failed", f"HTTP {result.status}")
+                fetch_log.write(result)
+
+            return fetch_all(
+                snapshot_urls(data["url"], SNAPSHOT_MODE).to_dict(),
+                save_response,
+                concurrency=WEBARCHIVE_CONCURRENCY,
+                rate=WEBARCHIVE_REQUESTS_PER_SECOND,
+                cache=cache,
+                revalidate=self.revalidate,
+            )
+
+    def download(self, data: pd.DataFrame) -> None:
+        if RESOLVE_WITH_CDX:
+            with HttpCache(self.http_cache_path, CDX_CACHE_TTL) as cdx_cache:
+                data = self.resolve(data, cdx_cache)
+                logging.info(f" CDX {cdx_cache.stats}")
+
+        with HttpCache(self.http_cache_path) as cache:
+            stats = self.fetch(data, cache)
+            logging.info(f" web.archive: {stats}, {cache.stats}, {cache.evict(HTTP_CACHE_MAX_BYTES)} entries evicted")
+
+
+def is_captcha_blocked(document):
+    return captcha_content in document
+
+
+def is_complete_page(document):
+    """
+    Heuristic for pages that were fully delivered: long enough and closed with </html>
+    """
+    return len(document) >= MIN_PAGE_LENGTH and "</html>" in document[-1000:].lower()
+
+
+def archivetoday_service(url: str) -> str:
+    """
+    Rate limit key of a url: the archive.today mirrors are one service, other urls are keyed by host
+    """
+    host = host_of(url)
+    return "archive.today" if host.lower().removeprefix("www.") in ARCHIVETODAY_MIRRORS else host
+
+
+def make_driver() -> webdriver.Chrome:
+    return webdriver.Chrome(options=chrome_options)
+
+
+class ArchiveTodayBackend(DownloadBackend):
+    source = "archivetoday"
+
+    def __init__(
+        self,
+        store: HtmlStore,
+        manifest: Manifest,
+        warc_writer: Optional[RollingWarcWriter] = None,
+        use_http_fast_path: bool = USE_HTTP_FAST_PATH,
+    ) -> None:
+        super().__init__(store, manifest, warc_writer)
+        self.use_http_fast_path = use_http_fast_path
+
+    def fetch_http(self, data: pd.DataFrame) -> FetchStats:
+        """
+        Downloads pages with plain HTTP requests.
+        Pages that are blocked by a captcha or look incomplete are not written,
+        so they are left for the selenium path
+        """
+
+        def save_response(result: FetchResult) -> None:
+            if result.status != 200:
+                return
+
+            content = result.content.decode("UTF8", errors="replace")
+            if is_captcha_blocked(content) or not is_complete_page(content):
+                return
+
+            if self.warc_writer is not None:
+                self.warc_writer.write_response(
+                    result.id, result.final_url, result.status, result.headers, result.content
+                )
+            else:
+                self.store.put(result.id, content)
+            self.manifest.mark(result.id, "fetched")
+
+        return fetch_all(
+            data["url"].to_dict(),
+            save_response,
+            concurrency=HTTP_CONCURRENCY,
+            rate=ARCHIVETODAY_REQUESTS_PER_SECOND,
+            max_rate=HTTP_MAX_REQUESTS_PER_SECOND,
+            headers=HTTP_HEADERS,
+            rate_limit_key=archivetoday_service,
+        )
+
+    def save_page(self, driver: webdriver.Chrome, i: str, url: str) -> None:
+        """
+        Downloads a single page with the supplied driver and writes it to the store,
+        or as a resource record to the WARC writer
+        """
+        try:
+            driver.get(url)
+            content = driver.page_source
+        except Exception as e:
+            self.manifest.mark(i, "failed", str(e)[:500])
+            raise
+
+        if is_captcha_blocked(content):
+            self.manifest.mark(i, "captcha")
+            raise AssertionError(f"{i} is blocked by a captcha")
+
+        if self.warc_writer is not None:
+            self.warc_writer.write_resource(i, url, content.encode("UTF8"))
+        else:
+            self.store.put(i, content)
+        self.manifest.mark(i, "fetched")
+
+    def download(self, data: pd.DataFrame) -> None:
+        if self.use_http_fast_path:
+            logging.info(f" archive.today HTTP fast path: {self.fetch_http(data)}")
+            data = self.pending(data)
+
+        # All drivers share one rate limit to not overload the site
+        failed = run_driver_pool(
+            data["url"].to_dict(),
+            self.save_page,
+            make_driver,
+            n_drivers=N_DRIVERS,
+            rate=ARCHIVETODAY_REQUESTS_PER_SECOND,
+            max_pages_per_driver=MAX_PAGES_PER_DRIVER,
+            max_attempts=MAX_ATTEMPTS,
+            retry_delay=RETRY_DELAY,
+        )
+        logging.info(f" archive.today: {len(failed)} pages failed {MAX_ATTEMPTS} attempts")
+
+
+class DownloadJob(NamedTuple):
+    backend: DownloadBackend
+    # Pending documents with a url column, indexed by post id
+    data: pd.DataFrame
+
+
+def run_downloads(jobs: List[DownloadJob]) -> Dict[str, float]:
+    """
+    Runs the backends at the same time, one thread each, and returns the seconds each
+    source took. A failing backend does not stop the others, its exception is raised
+    once all of them have finished
+    """
+
+    def run(job: DownloadJob) -> float:
+        started_at = time.monotonic()
+        job.backend.download(job.data)
+        return time.monotonic() - started_at
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(jobs))) as executor:
+        futures = {executor.submit(run, job): job.backend.source for job in jobs}
+        concurrent.futures.wait(futures)
+
+    seconds = {}
+    errors = []
+    for future, source in futures.items():
+        if future.exception() is not None:
+            logging.error(f" Downloading from {source} failed: {future.exception()!r}")
+            errors.append(future.exception())
+            continue
+        seconds[source] = future.result()
+        logging.info(f" Downloaded {source} in {seconds[source]:.1f}s")
+
+    if errors:
+        raise errors[0]
+    return seconds
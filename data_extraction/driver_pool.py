@@ -0,0 +1,147 @@
+"""
+Pool of long-lived selenium drivers pulling pages from a shared work queue.
+
+All drivers share one rate limit, so adding drivers increases throughput only
+until the politeness limit of the site is reached. A driver is replaced only
+when it fails a health check or after it has served a fixed number of pages.
+Failed pages go back to the end of the queue, so retries are interleaved with
+the remaining pages instead of waiting for a second pass.
+"""
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Dict, List
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from tqdm import tqdm
+
+
+class DriverPoolError(Exception):
+    pass
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter spacing requests from all threads at least 1 / rate seconds apart
+    """
+
+    def __init__(self, rate: float) -> None:
+        self.interval = 1 / rate
+        self.next_at = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            scheduled_at = max(now, self.next_at)
+            self.next_at = scheduled_at + self.interval
+        time.sleep(scheduled_at - now)
+
+
+def is_healthy(driver: webdriver.Chrome) -> bool:
+    """
+    Checks that the browser session still responds to commands
+    """
+    try:
+        driver.current_url
+        return True
+    except WebDriverException:
+        return False
+
+
+def quit_driver(driver: webdriver.Chrome) -> None:
+    try:
+        driver.quit()
+    except WebDriverException as e:
+        logging.warning(e)
+
+
+def run_driver_pool(
+    urls: Dict[str, str],
+    handle_page: Callable[[webdriver.Chrome, str, str], None],
+    make_driver: Callable[[], webdriver.Chrome],
+    n_drivers: int = 4,
+    rate: float = 1.0,
+    max_pages_per_driver: int = 200,
+    max_attempts: int = 1,
+    retry_delay: float = 30.0,
+) -> List[str]:
+    """
+    Calls `handle_page(driver, id, url)` for every item in `urls` (id -> url)
+    using `n_drivers` drivers in parallel. A page raising an exception is tried
+    again, at the earliest `retry_delay` seconds later, until it has been tried
+    `max_attempts` times. Returns the ids that failed every attempt.
+    Raises DriverPoolError when pages are left because no driver could be started
+    """
+    work = queue.Queue()
+    for i, url in urls.items():
+        work.put((i, url, 1, 0.0))
+
+    limiter = RateLimiter(rate)
+    failed = []
+    progress = tqdm(total=len(urls))
+
+    def worker() -> None:
+        # Started for the first page and again after every recycle
+        driver = None
+        n_pages = 0
+
+        try:
+            while True:
+                try:
+                    i, url, attempt, not_before = work.get_nowait()
+                except queue.Empty:
+                    return
+
+                if driver is None:
+                    try:
+                        driver = make_driver()
+                    except Exception as e:
+                        # The page is left for the drivers that are still running
+                        logging.error(f" Could not start a driver, stopping this worker: {e!r}")
+                        work.put((i, url, attempt, not_before))
+                        return
+
+                # Retries are queued behind the other pages, so this rarely waits
+                time.sleep(max(0.0, not_before - time.monotonic()))
+                limiter.wait()
+                try:
+                    handle_page(driver, i, url)
+                except Exception as e:
+                    print("Error occurred:")
+                    print(str(e)[:500])
+                    with open("error.log", "a") as f:
+                        f.write(str(e))
+
+                    if attempt < max_attempts:
+                        print(f"Skipping {i} for now...")
+                        work.put((i, url, attempt + 1, time.monotonic() + retry_delay))
+                    else:
+                        failed.append(i)
+                        progress.update()
+                else:
+                    progress.update()
+                finally:
+                    n_pages += 1
+
+                if n_pages >= max_pages_per_driver or not is_healthy(driver):
+                    logging.info(f" Recycling driver after {n_pages} pages")
+                    quit_driver(driver)
+                    driver = None
+                    n_pages = 0
+        finally:
+            if driver is not None:
+                quit_driver(driver)
+
+    threads = [threading.Thread(target=worker) for _ in range(n_drivers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    progress.close()
+    if not work.empty():
+        raise DriverPoolError(f"{work.qsize()} pages were not tried, no driver could be started")
+    return failed
@@ -1,60 +1,237 @@
+import hashlib
+import json
 import logging
 import multiprocessing
-import os
-from typing import List
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Tuple
 from xml.dom.minidom import Document
 
-import newspaper
-import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
-from common import update_preprocessing_log
+from common import read_config, read_table, write_table
+from extraction_cache import CacheStats, ExtractionCache, make_cache_key
+from extractors import EXTRACTION_ERRORS, Extractor, get_extractor
+from html_store import HtmlStore
+from manifest import Manifest
+from metrics import StageMetrics
+from warc_store import iter_warc_documents, list_warc_files
 
 TASK_NAME = "extract_documents"
+MODULE_NAME = "extract_documents"
 
-SYAC_DATASET_PATH = "../data/syac_dataset_raw.tsv"
+SYAC_DATASET_PATH = "../data/syac_dataset_raw.parquet"
+EXTRACTED_DOCUMENTS_PATH = "../data/intermediate/extracted_documents.jsonl"
+MAX_CHUNKSIZE = 64
 
-WEB_ARCHIVE_TSV_PATH = "../data/intermediate/webarchive_urls.tsv"
-ARCHIVE_TODAY_TSV_PATH = "../data/intermediate/archivetoday_urls.tsv"
+EXTRACTION_CACHE_PATH = "../data/intermediate/extraction_cache.sqlite"
+EXTRACTION_CACHE_MAX_BYTES = 2 * 1024**3
+CACHE_WRITE_BATCH_SIZE = 500
 
-WEB_ARCHIVE_RAW_PATH = "dataset_raw/webarchive/"
-ARCHIVE_TODAY_RAW_PATH = "dataset_raw/archivetoday/"
+WEB_ARCHIVE_TSV_PATH = "../data/intermediate/webarchive_urls.parquet"
+ARCHIVE_TODAY_TSV_PATH = "../data/intermediate/archivetoday_urls.parquet"
+
+WEB_ARCHIVE_RAW_PATH = "dataset_raw/webarchive"
+ARCHIVE_TODAY_RAW_PATH = "dataset_raw/archivetoday"
+
+WEB_ARCHIVE_WARC_PATH = "../data/warc/webarchive"
+ARCHIVE_TODAY_WARC_PATH = "../data/warc/archivetoday"
+
+# "store" reads pages from the html stores, "warc" streams them from the WARC files
+# written by download_documents with OUTPUT_FORMAT = "warc"
+INPUT_FORMAT = "store"
 
-# TODO: change
 data_types = {
     "webarchive": {
         "tsv": WEB_ARCHIVE_TSV_PATH,
         "raw_dir": WEB_ARCHIVE_RAW_PATH,
+        "warc_dir": WEB_ARCHIVE_WARC_PATH,
     },
     "archivetoday": {
         "tsv": ARCHIVE_TODAY_TSV_PATH,
         "raw_dir": ARCHIVE_TODAY_RAW_PATH,
+        "warc_dir": ARCHIVE_TODAY_WARC_PATH,
     },
 }
 
+# Stores opened by this process, see get_store
+_stores: Dict[str, HtmlStore] = {}
+
 
-def extract_documents(df: pd.DataFrame) -> List[str]:
+def get_store(root: str) -> HtmlStore:
     """
-    Uses newspaper.fulltext to parse the html document and
-    extract a string representation of the news articles
+    Opens each html store once per worker process
     """
+    if root not in _stores:
+        _stores[root] = HtmlStore(root)
+    return _stores[root]
 
-    extracted_documents = []
 
-    for doc_id in tqdm(list(df.index)):
-        try:
-            # TODO: change this to "rb"?
-            with open(df["path"].loc[doc_id], "r", encoding="UTF8") as f:
-                doc_str = f.read()
-            fulltext = newspaper.fulltext(doc_str)
-            extracted_documents.append(fulltext)
-        except (AttributeError, UnicodeDecodeError) as e:
-            logging.info(e)
-            df.drop(doc_id, inplace=True)
+class ExtractionResult(NamedTuple):
+    id: str
+    # None when extraction failed, with a description in error
+    body: Optional[str]
+    error: Optional[str]
+    # None when the page could not be read, which is not cached
+    cache_key: Optional[str]
+    cached: bool
 
-    df["body"] = extracted_documents
-    return df
+
+# Set in each worker by init_worker
+_extractor: Optional[Extractor] = None
+# Post ids to keep when reading WARC files
+_wanted_ids: Set[str] = set()
+# Path and read-only connection to the extraction cache, see get_cache
+_cache_path = EXTRACTION_CACHE_PATH
+_cache: Optional[ExtractionCache] = None
+
+
+def get_cache() -> ExtractionCache:
+    """
+    Opens the extraction cache read-only once per worker process
+    """
+    global _cache
+    if _cache is None:
+        _cache = ExtractionCache(_cache_path, readonly=True)
+    return _cache
+
+
+def extract_with_cache(doc_id: str, content_hash: str, load_html: Callable[[], str]) -> ExtractionResult:
+    """
+    Serves the article from the extraction cache, only parsing the page on a cache miss
+    """
+    key = make_cache_key(content_hash, _extractor.name, _extractor.version, _extractor.options)
+    cached = get_cache().get(key)
+    if cached is not None:
+        return ExtractionResult(doc_id, *cached, key, True)
+
+    try:
+        return ExtractionResult(doc_id, _extractor.extract(load_html()), None, key, False)
+    except EXTRACTION_ERRORS as e:
+        return ExtractionResult(doc_id, None, repr(e), key, False)
+
+
+def extract_document(task: Tuple[str, str]) -> ExtractionResult:
+    """
+    Extracts the article of a (post id, store root) task.
+    Only the ids and texts travel between processes, the page is read by the worker
+    """
+    doc_id, store_root = task
+    store = get_store(store_root)
+    try:
+        content_hash = store.content_hash(doc_id)
+    except KeyError as e:
+        return ExtractionResult(doc_id, None, repr(e), None, False)
+    return extract_with_cache(doc_id, content_hash, lambda: store.get_text(doc_id))
+
+
+def init_worker(extractor: Extractor, wanted_ids: Set[str], cache_path: str) -> None:
+    global _extractor, _wanted_ids, _cache_path
+    _extractor = extractor
+    _wanted_ids = wanted_ids
+    _cache_path = cache_path
+
+
+def extract_warc_file(path: str) -> List[ExtractionResult]:
+    """
+    Extracts the articles of every wanted post in a WARC file, which is read by the worker
+    """
+    return [
+        extract_with_cache(doc_id, hashlib.sha256(content).hexdigest(), lambda: content.decode("UTF8"))
+        for doc_id, content in iter_warc_documents([path], ids=_wanted_ids)
+    ]
+
+
+def get_chunksize(n_tasks: int, n_cores: int) -> int:
+    """
+    Large enough to keep the IPC overhead low, small enough to balance the load between workers
+    """
+    return max(1, min(MAX_CHUNKSIZE, n_tasks // (n_cores * 8)))
+
+
+class ResultWriter:
+    """
+    Appends extracted articles to a JSONL file and keeps the extraction cache up to date
+    """
+
+    def __init__(self, f, cache: ExtractionCache) -> None:
+        self.f = f
+        self.cache = cache
+        self.stats = CacheStats()
+        self.n_extracted = 0
+        self.n_failed = 0
+        self.new_entries = []
+        self.hit_keys = []
+
+    def write(self, result: ExtractionResult) -> None:
+        if result.cached:
+            self.stats.hits += 1
+            self.hit_keys.append(result.cache_key)
+        elif result.cache_key is not None:
+            self.stats.misses += 1
+            self.new_entries.append((result.cache_key, result.body, result.error))
+
+        if len(self.new_entries) + len(self.hit_keys) >= CACHE_WRITE_BATCH_SIZE:
+            self.flush()
+
+        if result.body is None:
+            logging.info(f"{result.id}: {result.error}")
+            self.n_failed += 1
+            return
+
+        self.f.write(json.dumps({"id": result.id, "body": result.body}) + "\n")
+        self.n_extracted += 1
+
+    def flush(self) -> None:
+        self.cache.put_many(self.new_entries)
+        self.cache.touch_many(self.hit_keys)
+        self.new_entries = []
+        self.hit_keys = []
+
+
+def run_extraction(df: pd.DataFrame, extractor: Extractor, output_path: str, n_cores: int) -> None:
+    """
+    Streams extraction tasks through a worker pool and appends every extracted
+    article to the JSONL file at `output_path` as soon as it is returned
+    """
+    cache = ExtractionCache(EXTRACTION_CACHE_PATH)
+
+    with open(output_path, "w", encoding="UTF8") as f:
+        writer = ResultWriter(f, cache)
+
+        if INPUT_FORMAT == "warc":
+            paths = [
+                path for source in df["source"].unique() for path in list_warc_files(data_types[source]["warc_dir"])
+            ]
+            with multiprocessing.Pool(n_cores, init_worker, (extractor, set(df.index), EXTRACTION_CACHE_PATH)) as pool:
+                for results in tqdm(pool.imap_unordered(extract_warc_file, paths), total=len(paths)):
+                    for result in results:
+                        writer.write(result)
+        else:
+            tasks = zip(df.index, df["store"])
+            chunksize = get_chunksize(len(df), n_cores)
+            with multiprocessing.Pool(n_cores, init_worker, (extractor, set(), EXTRACTION_CACHE_PATH)) as pool:
+                for result in tqdm(pool.imap_unordered(extract_document, tasks, chunksize), total=len(df)):
+                    writer.write(result)
+
+        writer.flush()
+
+    writer.stats.evicted = cache.evict(EXTRACTION_CACHE_MAX_BYTES)
+    cache.close()
+
+    logging.info(f" Extracted {writer.n_extracted} documents, {writer.n_failed} failed")
+    print(writer.stats)
+
+
+def read_extracted_documents(path: str) -> pd.Series:
+    """
+    Reads the extracted articles as a Series of bodies indexed by post id
+    """
+    bodies = {}
+    with open(path, "r", encoding="UTF8") as f:
+        for line in f:
+            record = json.loads(line)
+            bodies[record["id"]] = record["body"]
+    return pd.Series(bodies, dtype=object)
 
 
 def assemble_syac_dataset(df: pd.DataFrame) -> pd.DataFrame:
@@ -69,45 +246,55 @@ def assemble_syac_dataset(df: pd.DataFrame) -> pd.DataFrame:
     df = df[df["title"].apply(lambda x: "|" in x)]
     
     # Strip data from leading and trailing spaces
-    df["title"] = [i.split("|")[0].strip() for i in df["title"]]
     df["target"] = [i.split("|")[1].strip() for i in df["title"]]
+    df["title"] = [i.split("|")[0].strip() for i in df["title"]]
 
     df.drop("url", axis=1, inplace=True)
-    df.drop("path", axis=1, inplace=True)
+    df.drop("store", axis=1, inplace=True)
+    df.drop("source", axis=1, inplace=True)
 
     return df
 
 
-def get_raw_document_ids(path):
-    document_ids = [i[:-5] for i in os.listdir(path)]
-    return document_ids
-
-
-def get_df_for_local_docuemnts(tsv_path, local_dir):
-    data = pd.read_csv(tsv_path, index_col=0, sep="\t")
-    document_ids = get_raw_document_ids(local_dir)
-    df = data.loc[data.index.intersection(document_ids)]
-    df["path"] = [f"{local_dir}/{i}.html" for i in df.index]
+def get_df_for_local_docuemnts(tsv_path, store_root, document_ids, source):
+    data = read_table(tsv_path)
+    df = data.loc[data.index.intersection(document_ids)].copy()
+    df["store"] = store_root
+    df["source"] = source
     return df
 
 
 def main() -> None:
+    module_config = read_config([MODULE_NAME])[MODULE_NAME]
+    extractor = get_extractor(module_config["extractor"], module_config.get("extractor_options"))
+
     used_datasources = ["archivetoday", "webarchive"]
 
-    dfs = [get_df_for_local_docuemnts(data_types[i]["tsv"], data_types[i]["raw_dir"]) for i in used_datasources]
+    with StageMetrics(TASK_NAME) as metrics:
+        manifest = Manifest()
+        dfs = [
+            get_df_for_local_docuemnts(
+                data_types[i]["tsv"], data_types[i]["raw_dir"], manifest.downloaded_ids(i), i
+            )
+            for i in used_datasources
+        ]
 
-    df = pd.concat(dfs)
+        df = pd.concat(dfs)
+        metrics.rows_in = len(df)
 
-    n_cores = multiprocessing.cpu_count()
-    with multiprocessing.Pool(n_cores) as pool:
-        df_fragments = np.array_split(df, n_cores * 4)
-        extracted_data = pool.map(extract_documents, tqdm(df_fragments))
+        run_extraction(df, extractor, EXTRACTED_DOCUMENTS_PATH, multiprocessing.cpu_count())
 
-    df = pd.concat(extracted_data)
+        bodies = read_extracted_documents(EXTRACTED_DOCUMENTS_PATH)
+        # Keeps the order of df, so the assembled dataset does not depend on worker scheduling
+        extracted = df.loc[df.index.intersection(bodies.index)].copy()
+        extracted["body"] = bodies
+        metrics.drop("extraction_failed", len(df) - len(extracted))
+        manifest.mark_many(extracted.index, "extracted")
 
-    dataset = assemble_syac_dataset(df)
-    dataset.to_csv(SYAC_DATASET_PATH, sep="\t")
-    update_preprocessing_log(len(dataset), TASK_NAME)
+        dataset = assemble_syac_dataset(extracted)
+        metrics.drop("no_pipe_in_title", len(extracted) - len(dataset))
+        write_table(dataset, SYAC_DATASET_PATH)
+        metrics.rows_out = len(dataset)
 
 
 if __name__ == "__main__":
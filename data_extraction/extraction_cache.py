@@ -0,0 +1,107 @@
+"""
+Persistent cache of extracted articles, keyed by the content hash of the page
+and the name, version and options of the extractor.
+
+Worker processes open the cache read-only; only the main process writes to it.
+The cache is bounded in size by evicting the least recently used entries.
+"""
+import hashlib
+import json
+import sqlite3
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import zstandard
+
+from sqlite_utils import evict_least_recently_used
+
+
+def make_cache_key(
+    content_hash: str, extractor_name: str, extractor_version: str, options: Dict[str, Any]
+) -> str:
+    key = json.dumps([content_hash, extractor_name, extractor_version, options], sort_keys=True)
+    return hashlib.sha256(key.encode("UTF8")).hexdigest()
+
+
+class ExtractionCache:
+    def __init__(self, path: str, readonly: bool = False) -> None:
+        if readonly:
+            self.db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            return
+
+        self.db = sqlite3.connect(path)
+        # WAL lets the workers read while the main process writes
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS extractions ("
+            "key TEXT PRIMARY KEY, body BLOB, error TEXT, size INTEGER NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS extractions_accessed_at ON extractions (accessed_at)")
+        self.db.commit()
+
+    def get(self, key: str) -> Optional[Tuple[Optional[str], Optional[str]]]:
+        """
+        Returns the cached (body, error) pair, or None on a cache miss
+        """
+        row = self.db.execute("SELECT body, error FROM extractions WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+
+        body, error = row
+        if body is not None:
+            body = zstandard.ZstdDecompressor().decompress(body).decode("UTF8")
+        return body, error
+
+    def put_many(self, entries: Iterable[Tuple[str, Optional[str], Optional[str]]]) -> None:
+        """
+        Stores (key, body, error) entries, failed extractions are cached with a None body
+        """
+        compressor = zstandard.ZstdCompressor()
+        now = time.time()
+        rows = []
+        for key, body, error in entries:
+            compressed = None if body is None else compressor.compress(body.encode("UTF8"))
+            rows.append((key, compressed, error, len(compressed or b""), now))
+
+        self.db.executemany(
+            "INSERT OR REPLACE INTO extractions (key, body, error, size, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+        self.db.commit()
+
+    def touch_many(self, keys: Iterable[str]) -> None:
+        now = time.time()
+        self.db.executemany("UPDATE extractions SET accessed_at = ? WHERE key = ?", ((now, k) for k in keys))
+        self.db.commit()
+
+    def total_bytes(self) -> int:
+        return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM extractions").fetchone()[0]
+
+    def evict(self, max_bytes: int) -> int:
+        """
+        Removes the least recently used entries until the cache fits in `max_bytes`
+        and returns the number of removed entries
+        """
+        n_removed = evict_least_recently_used(self.db, "extractions", "key", max_bytes)
+        if n_removed:
+            self.db.commit()
+            self.db.execute("VACUUM")
+        return n_removed
+
+    def close(self) -> None:
+        self.db.close()
+
+
+class CacheStats:
+    def __init__(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def __str__(self) -> str:
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0.0
+        return (
+            f"Extraction cache: {self.hits} hits, {self.misses} misses "
+            f"({hit_rate:.1%} hit rate), {self.evicted} entries evicted"
+        )
@@ -0,0 +1,89 @@
+"""
+Article extractor backends, selected with the extractor field of the
+[extract_documents] section in config.toml
+"""
+from typing import Any, Dict, Type
+
+import lxml.etree
+import lxml.html
+import newspaper
+
+
+class ExtractionError(Exception):
+    pass
+
+
+class Extractor:
+    """
+    Extracts the article text of an html page.
+    name, version and options are part of the extraction cache key
+    """
+
+    name = ""
+    version = ""
+
+    def __init__(self, **options: Any) -> None:
+        self.options = options
+
+    def extract(self, html: str) -> str:
+        raise NotImplementedError
+
+
+class NewspaperExtractor(Extractor):
+    name = "newspaper"
+    version = newspaper.__version__
+
+    def extract(self, html: str) -> str:
+        return newspaper.fulltext(html, **self.options)
+
+
+class LxmlExtractor(Extractor):
+    """
+    Fast paragraph based extractor: keeps the text of the <p> elements outside of
+    boilerplate containers, joined by blank lines like newspaper.fulltext
+    """
+
+    name = "lxml"
+    version = "1"
+
+    BOILERPLATE_TAGS = ("script", "style", "noscript", "nav", "header", "footer", "aside", "form", "iframe")
+    # Toolbar injected by the Wayback Machine in rewritten snapshots
+    BOILERPLATE_IDS = ("wm-ipp-base", "wm-ipp", "donato")
+
+    def __init__(self, min_paragraph_chars: int = 30, **options: Any) -> None:
+        super().__init__(min_paragraph_chars=min_paragraph_chars, **options)
+        self.min_paragraph_chars = min_paragraph_chars
+
+    def extract(self, html: str) -> str:
+        try:
+            doc = lxml.html.fromstring(html)
+        except (lxml.etree.ParserError, ValueError) as e:
+            raise ExtractionError(e)
+
+        for element in list(doc.iter(*self.BOILERPLATE_TAGS)):
+            element.drop_tree()
+        for element_id in self.BOILERPLATE_IDS:
+            for element in doc.xpath("//*[@id=$id]", id=element_id):
+                element.drop_tree()
+
+        paragraphs = (" ".join(p.text_content().split()) for p in doc.iter("p"))
+        text = "\n\n".join(p for p in paragraphs if len(p) >= self.min_paragraph_chars)
+
+        if not text:
+            raise ExtractionError("No paragraphs found")
+        return text
+
+
+EXTRACTORS: Dict[str, Type[Extractor]] = {
+    NewspaperExtractor.name: NewspaperExtractor,
+    LxmlExtractor.name: LxmlExtractor,
+}
+
+# Exceptions marking a document that could not be extracted
+EXTRACTION_ERRORS = (ExtractionError, AttributeError, UnicodeDecodeError)
+
+
+def get_extractor(name: str, options: Dict[str, Any] = None) -> Extractor:
+    if name not in EXTRACTORS:
+        raise ValueError(f"Unknown extractor {name}, choose one of {', '.join(EXTRACTORS)}")
+    return EXTRACTORS[name](**(options or {}))
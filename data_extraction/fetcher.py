@@ -0,0 +1,325 @@
+"""
+Concurrent asyncio fetch engine used by the web.archive collectors.
+
+Requests are limited by a global concurrency cap and a token bucket per host.
+The bucket rate adapts with AIMD: it grows additively while the host answers
+normally and is cut multiplicatively whenever the host answers 429 (or sends a
+Retry-After header), in which case the request is queued again.
+
+With an HttpCache, fresh cached responses are handled before any request is made
+and stale ones are revalidated with a conditional request.
+"""
+import asyncio
+import json
+import logging
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable, Dict, List, NamedTuple, Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+from tqdm import tqdm
+
+from http_cache import CachedResponse, HttpCache, conditional_headers
+
+THROTTLED_STATUSES = (429, 503)
+# Throttled responses arriving together are one congestion event and only slow down the rate once
+DECREASE_COOLDOWN = 1.0
+
+
+class FetchResult(NamedTuple):
+    id: str
+    url: str
+    status: int
+    final_url: str
+    headers: Dict[str, str]
+    content: bytes
+    latency: float
+    # Served from the HTTP cache, with or without revalidating it
+    cached: bool = False
+
+
+def cached_result(id: str, url: str, entry: CachedResponse, latency: float = 0.0) -> FetchResult:
+    return FetchResult(id, url, entry.status, entry.final_url, entry.headers, entry.content, latency, cached=True)
+
+
+class TokenBucket:
+    """
+    Per-host token bucket with an AIMD controlled refill rate
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        min_rate: float,
+        max_rate: float,
+        increase: float = 0.1,
+        decrease: float = 0.5,
+    ) -> None:
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.capacity = 1.0
+        self.tokens = 1.0
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.decreased_at = 0.0
+        self.lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self) -> None:
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def reward(self) -> None:
+        "Additive increase after a successful request"
+        self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def penalize(self, retry_after: Optional[float] = None) -> None:
+        "Multiplicative decrease after the host asked us to slow down"
+        now = time.monotonic()
+        if retry_after:
+            self.paused_until = max(self.paused_until, now + retry_after)
+
+        if now - self.decreased_at >= DECREASE_COOLDOWN:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.decreased_at = now
+            logging.info(f" Slowing down to {self.rate:.2f} requests/s")
+
+
+class FetchStats:
+    def __init__(self) -> None:
+        self.started_at = time.monotonic()
+        self.pages = 0
+        self.throttled = 0
+        self.failed = 0
+        self.cached = 0
+
+    @property
+    def pages_per_second(self) -> float:
+        elapsed = time.monotonic() - self.started_at
+        return self.pages / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.pages} pages ({self.pages_per_second:.2f} pages/s), "
+            f"{self.cached} from cache, {self.throttled} throttled responses, {self.failed} failed requests"
+        )
+
+
+class FetchLog:
+    """
+    Append-only JSONL log holding a compact metadata record per fetched url.
+    Records are flushed as they are written, so the log survives a crash mid-run.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.file = open(path, "a", encoding="UTF8")
+
+    def write(self, result: FetchResult) -> None:
+        record = {
+            "id": result.id,
+            "url": result.url,
+            "status": result.status,
+            "final_url": result.final_url,
+            "bytes": len(result.content),
+            "latency": round(result.latency, 4),
+            "cached": result.cached,
+            "headers": result.headers,
+            "fetched_at": time.time(),
+        }
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __enter__(self) -> "FetchLog":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def read_fetch_log(path: str) -> List[Dict]:
+    """
+    Reads the records of a fetch log, skipping a truncated last line left by a crash
+    """
+    records = []
+    with open(path, "r", encoding="UTF8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                logging.warning(f"Skipping malformed fetch log line in {path}")
+    return records
+
+
+def host_of(url: str) -> str:
+    return urlsplit(url).netloc
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parses a Retry-After header, which is either a number of seconds or an HTTP date
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+async def fetch_all_async(
+    urls: Dict[str, str],
+    handle_result: Callable[[FetchResult], None],
+    concurrency: int = 8,
+    rate: float = 2.0,
+    min_rate: float = 0.1,
+    max_rate: float = 20.0,
+    max_attempts: int = 5,
+    timeout: float = 60.0,
+    headers: Optional[Dict[str, str]] = None,
+    cache: Optional[HttpCache] = None,
+    revalidate: bool = False,
+    rate_limit_key: Callable[[str], str] = host_of,
+) -> FetchStats:
+    """
+    Fetches every url in `urls` (id -> url) and passes each result to `handle_result`.
+    An exception raised by `handle_result` stops the fetch and is raised again.
+    Requests failing with connection errors or throttled more than `max_attempts` times
+    are given up on. `headers` are sent with every request.
+    Urls with the same `rate_limit_key`, by default their host, share a token bucket.
+    Responses in `cache` are used without a request while fresh, or always revalidated
+    when `revalidate` is set. Every downloaded 200 response is stored in the cache.
+    """
+    buckets: Dict[str, TokenBucket] = {}
+    stats = FetchStats()
+    progress = tqdm(total=len(urls))
+
+    queue = asyncio.Queue()
+    hit_urls = []
+    for id, url in urls.items():
+        # No request is in flight yet, so the lookups do not have to leave the event loop
+        entry = cache.get(url) if cache is not None and not revalidate else None
+        if entry is not None and cache.is_fresh(entry):
+            # Cache hits do not take a token, so they are not rate limited
+            cache.stats.hits += 1
+            stats.cached += 1
+            stats.pages += 1
+            handle_result(cached_result(id, url, entry))
+            hit_urls.append(url)
+            progress.update()
+        else:
+            queue.put_nowait((id, url, 1))
+    if hit_urls:
+        cache.touch_many(hit_urls)
+
+    async def worker(session: aiohttp.ClientSession) -> None:
+        while True:
+            id, url, attempt = await queue.get()
+            bucket = buckets.setdefault(rate_limit_key(url), TokenBucket(rate, min_rate, max_rate))
+
+            # The cache is used from a thread, sqlite and zstd would stall every request in flight
+            entry = await asyncio.to_thread(cache.get, url) if cache is not None else None
+            try:
+                await bucket.acquire()
+                started_at = time.monotonic()
+                request_headers = conditional_headers(entry) if entry is not None else None
+                async with session.get(url, headers=request_headers) as response:
+                    content = await response.read()
+                    result = FetchResult(
+                        id=id,
+                        url=url,
+                        status=response.status,
+                        final_url=str(response.url),
+                        headers=dict(response.headers),
+                        content=content,
+                        latency=time.monotonic() - started_at,
+                    )
+                logging.info(f"{url} {result.status}")
+
+                if cache is not None:
+                    if result.status == 304 and entry is not None:
+                        cache.stats.revalidated += 1
+                        await asyncio.to_thread(cache.refresh, url)
+                        stats.cached += 1
+                        result = cached_result(id, url, entry, result.latency)
+                    else:
+                        cache.stats.misses += 1
+                        if result.status == 200:
+                            await asyncio.to_thread(
+                                cache.put, url, result.status, result.headers, result.content, result.final_url
+                            )
+
+                if result.status in THROTTLED_STATUSES:
+                    stats.throttled += 1
+                    bucket.penalize(parse_retry_after(result.headers.get("Retry-After")))
+                    if attempt < max_attempts:
+                        queue.put_nowait((id, url, attempt + 1))
+                        continue
+                else:
+                    bucket.reward()
+
+                stats.pages += 1
+                handle_result(result)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.warning(f"{url} {e!r}")
+                if attempt < max_attempts:
+                    queue.put_nowait((id, url, attempt + 1))
+                    continue
+                stats.failed += 1
+            finally:
+                queue.task_done()
+
+            progress.update()
+            progress.set_postfix(pages_per_second=f"{stats.pages_per_second:.2f}")
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    async with aiohttp.ClientSession(
+        connector=connector, timeout=client_timeout, headers=headers
+    ) as session:
+        workers = [asyncio.create_task(worker(session)) for _ in range(concurrency)]
+        # A worker only returns by raising, e.g. when handle_result fails, which would
+        # otherwise leave queue.join() waiting for items no worker is left to take
+        joined = asyncio.create_task(queue.join())
+        await asyncio.wait([joined, *workers], return_when=asyncio.FIRST_COMPLETED)
+        for task in [joined, *workers]:
+            task.cancel()
+        outcomes = await asyncio.gather(*workers, return_exceptions=True)
+
+    progress.close()
+    errors = [o for o in outcomes if isinstance(o, Exception)]
+    if errors:
+        raise errors[0]
+    logging.info(f" Fetched {stats}")
+    return stats
+
+
+def fetch_all(urls: Dict[str, str], handle_result: Callable[[FetchResult], None], **kwargs) -> FetchStats:
+    """
+    Synchronous entry point for fetch_all_async
+    """
+    return asyncio.run(fetch_all_async(urls, handle_result, **kwargs))
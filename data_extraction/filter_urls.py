@@ -1,70 +1,102 @@
 import logging
-from collections import Counter
-from typing import Tuple
+from typing import Any, Callable, List, Optional, Set, Tuple
 
+import numpy as np
 import pandas as pd
+import tldextract
 
-from common import update_preprocessing_log
+from common import read_config, read_table, write_table
+from metrics import StageMetrics
 
 TASK_NAME = "filter_urls"
 
-# Rules for dataset:
-# No websites with less than 100 instances
-# No video or image websites or meta posts
-BLACKLIST_DOMAINS = [
-    "streamable.com",  # video
-    "youtube.com",  # video
-    "i.redd.it",  # image
-    "reddit.com",  # meta
-    "unv.is",  # doesnt work for requests
-    "unvis.it",  # doesnt work for requests
-]
-
-
-def get_domain(url: str) -> str:
-    return (
-        url.replace("https://", "")
-        .replace("http://", "")
-        .replace("www.", "")
-        .split("/")[0]
-    )
-
-
-def get_domains(df: pd.DataFrame) -> pd.DataFrame:
-    urls = df["url"]
-    urls = urls.map(get_domain)
-    return urls
-
-
-def filter_invalid_domains(df_raw: pd.DataFrame) -> pd.DataFrame:
-    domains = get_domains(df_raw)
-    counts = Counter(domains)
-    frequent_domains = domains[domains.apply(lambda s: counts[s] >= 100)]
-    valid_domains = frequent_domains[
-        frequent_domains.apply(lambda s: s not in BLACKLIST_DOMAINS)
-    ]
-    logging.info(valid_domains.unique())
-    new_df = df_raw.loc[valid_domains.index]
+# Public suffix list bundled with tldextract, so results do not depend on a download
+extract_suffix = tldextract.TLDExtract(suffix_list_urls=())
+
+# Host of a url, without scheme, credentials, port, path or query
+HOST_PATTERN = r"^(?:[A-Za-z][A-Za-z0-9+.-]*://)?(?:[^@/?#]*@)?(\[[^\]]*\]|[^/:?#]+)"
+
+
+def get_registered_domain(host: str) -> str:
+    """
+    Domain registered under a public suffix, e.g. bbc.co.uk for news.bbc.co.uk.
+    Hosts without a known suffix, like ip addresses, are returned as is
+    """
+    return extract_suffix(host).registered_domain or host
+
+
+def map_unique(values: pd.Series, func: Callable[[str], Any]) -> pd.Series:
+    """
+    Applies func once per distinct value, urls share a handful of hosts
+    """
+    codes, uniques = pd.factorize(values)
+    mapped = np.array([func(u) for u in uniques], dtype=object)
+    return pd.Series(mapped[codes], index=values.index)
+
+
+def get_hosts(df: pd.DataFrame) -> pd.Series:
+    """
+    Lowercase host of every url, without a leading www.
+    """
+    hosts = df["url"].str.extract(HOST_PATTERN, expand=False).fillna("")
+    return map_unique(hosts, lambda h: h.lower().removeprefix("www."))
+
+
+def get_domains(df: pd.DataFrame) -> pd.Series:
+    return map_unique(get_hosts(df), get_registered_domain)
+
+
+def is_blacklisted(host: str, blacklist: Set[str]) -> bool:
+    """
+    True when the host or one of its parent domains is blacklisted
+    """
+    labels = host.split(".")
+    return any(".".join(labels[i:]) in blacklist for i in range(len(labels)))
+
+
+def filter_invalid_domains(
+    df_raw: pd.DataFrame, min_domain_count: int, blacklist_domains: List[str], metrics: Optional[StageMetrics] = None
+) -> pd.DataFrame:
+    hosts = get_hosts(df_raw)
+    domains = map_unique(hosts, get_registered_domain)
+
+    counts = domains.value_counts()
+    is_frequent = domains.isin(counts.index[counts >= min_domain_count])
+    blacklist = set(blacklist_domains)
+    has_host = hosts != ""
+    is_allowed = ~map_unique(hosts, lambda h: is_blacklisted(h, blacklist)).astype(bool)
+    is_valid = is_frequent & has_host & is_allowed
+
+    if metrics is not None:
+        metrics.drop("missing_url", int((~has_host).sum()))
+        metrics.drop("blacklisted_domain", int((has_host & ~is_allowed).sum()))
+        metrics.drop("rare_domain", int((has_host & is_allowed & ~is_frequent).sum()))
+
+    logging.info(domains[is_valid].unique())
+    new_df = df_raw[is_valid.to_numpy()]
     return new_df
 
 
 def separate_archive_today_urls(df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
-    is_archive = get_domains(df).map(lambda s: s.startswith("archive"))
+    is_archive = get_hosts(df).str.startswith("archive").to_numpy()
     archive_df = df[is_archive]
     non_archive_df = df[~is_archive]
     return archive_df, non_archive_df
 
 
 def main() -> None:
-    df_raw = pd.read_csv("../data/intermediate/syac_urls_raw.tsv", index_col=0, sep="\t")
-    new_df = filter_invalid_domains(df_raw)
+    config = read_config([TASK_NAME])[TASK_NAME]
 
-    archive_df, non_archive_df = separate_archive_today_urls(new_df)
+    with StageMetrics(TASK_NAME) as metrics:
+        df_raw = read_table("../data/intermediate/syac_urls_raw.parquet")
+        metrics.rows_in = len(df_raw)
+        new_df = filter_invalid_domains(df_raw, config["min_domain_count"], config["blacklist_domains"], metrics)
 
-    archive_df.to_csv("../data/intermediate/archivetoday_urls.tsv", sep="\t")
-    non_archive_df.to_csv("../data/intermediate/webarchive_urls.tsv", sep="\t")
+        archive_df, non_archive_df = separate_archive_today_urls(new_df)
 
-    update_preprocessing_log(len(archive_df) + len(non_archive_df), TASK_NAME)
+        write_table(archive_df, "../data/intermediate/archivetoday_urls.parquet")
+        write_table(non_archive_df, "../data/intermediate/webarchive_urls.parquet")
+        metrics.rows_out = len(archive_df) + len(non_archive_df)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,120 @@
+"""
+Compressed, content-addressed store for the raw html pages.
+
+Page bodies are zstd compressed and written once per sha256 content hash,
+sharded as objects/<h[:2]>/<h[2:4]>/<h>.zst. An sqlite index maps post ids
+to content hashes, so lookups never have to scan a directory.
+"""
+import argparse
+import hashlib
+import os
+import threading
+from typing import List, Union
+
+import zstandard
+from tqdm import tqdm
+
+from sqlite_utils import connect_shared
+
+COMPRESSION_LEVEL = 10
+
+
+class HtmlStore:
+    def __init__(self, root: str) -> None:
+        self.root = root
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+
+        self.db, self.lock = connect_shared(os.path.join(root, "index.sqlite"))
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS documents "
+            "(id TEXT PRIMARY KEY, hash TEXT NOT NULL, size INTEGER NOT NULL)"
+        )
+        self.db.commit()
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.root, "objects", digest[:2], digest[2:4], f"{digest}.zst")
+
+    def put(self, doc_id: str, content: Union[bytes, str]) -> str:
+        """
+        Stores a page under `doc_id` and returns its content hash.
+        Identical bodies are only written once
+        """
+        if isinstance(content, str):
+            content = content.encode("UTF8")
+
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._object_path(digest)
+
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            compressed = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL).compress(content)
+            # Write to a temporary file first so a crash never leaves a truncated object
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(compressed)
+            os.replace(tmp_path, path)
+
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO documents (id, hash, size) VALUES (?, ?, ?)",
+                (doc_id, digest, len(content)),
+            )
+            self.db.commit()
+
+        return digest
+
+    def content_hash(self, doc_id: str) -> str:
+        with self.lock:
+            row = self.db.execute("SELECT hash FROM documents WHERE id = ?", (doc_id,)).fetchone()
+        if row is None:
+            raise KeyError(doc_id)
+        return row[0]
+
+    def get(self, doc_id: str) -> bytes:
+        with open(self._object_path(self.content_hash(doc_id)), "rb") as f:
+            return zstandard.ZstdDecompressor().decompress(f.read())
+
+    def get_text(self, doc_id: str) -> str:
+        return self.get(doc_id).decode("UTF8")
+
+    def ids(self) -> List[str]:
+        with self.lock:
+            return [row[0] for row in self.db.execute("SELECT id FROM documents")]
+
+    def __contains__(self, doc_id: str) -> bool:
+        with self.lock:
+            row = self.db.execute("SELECT 1 FROM documents WHERE id = ?", (doc_id,)).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def close(self) -> None:
+        self.db.close()
+
+
+def import_html_dir(html_dir: str, store: HtmlStore) -> None:
+    """
+    Moves a flat directory of <id>.html files into the store
+    """
+    for filename in tqdm(os.listdir(html_dir)):
+        if not filename.endswith(".html"):
+            continue
+        with open(os.path.join(html_dir, filename), "rb") as f:
+            store.put(filename[:-5], f.read())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Imports a directory of <id>.html files into an html store")
+    parser.add_argument("html_dir")
+    parser.add_argument("store_root")
+    args = parser.parse_args()
+
+    store = HtmlStore(args.store_root)
+    import_html_dir(args.html_dir, store)
+    print(f"{len(store)} documents in {args.store_root}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+On-disk HTTP cache shared by the collectors, keyed by normalized url.
+
+Responses are zstd compressed in a single sqlite file. An entry younger than the
+cache's ttl is served without touching the network; older entries (or every entry,
+when revalidating) are requested again with If-None-Match / If-Modified-Since, and
+a 304 answer serves the stored body. The cache is bounded by evicting expired
+and least recently used entries.
+
+The fetch engine takes an HttpCache directly, the cache is inspected and trimmed with:
+
+    python http_cache.py stats
+    python http_cache.py evict --max-bytes 1000000000 --max-age 2592000
+"""
+import argparse
+import json
+import time
+from typing import Dict, Iterable, NamedTuple, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+import zstandard
+
+from sqlite_utils import connect_shared, evict_least_recently_used
+
+HTTP_CACHE_PATH = "../data/intermediate/http_cache.sqlite"
+COMPRESSION_LEVEL = 10
+DEFAULT_PORTS = {"http": 80, "https": 443}
+# Headers describing the transfer rather than the stored body, which is kept decoded
+TRANSFER_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection", "keep-alive"}
+# Headers only valid for the request that received them, replaying them would
+# e.g. make a client sleep on a rate limit that has long been reset
+PER_REQUEST_HEADERS = {"set-cookie", "retry-after"}
+PER_REQUEST_HEADER_PREFIXES = ("x-ratelimit-",)
+
+
+def normalize_url(url: str) -> str:
+    """
+    Cache key of a url. Only changes that cannot change the response are made:
+    lowercase scheme and host, no default port, an empty path becomes / and the fragment is dropped
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port is not None and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    return urlunsplit((scheme, host, parts.path or "/", parts.query, ""))
+
+
+class CachedResponse(NamedTuple):
+    url: str
+    status: int
+    final_url: str
+    headers: Dict[str, str]
+    content: bytes
+    # Time of the last download or successful revalidation
+    stored_at: float
+
+
+class HttpCacheStats:
+    def __init__(self) -> None:
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def __str__(self) -> str:
+        total = self.hits + self.revalidated + self.misses
+        hit_rate = (self.hits + self.revalidated) / total if total else 0.0
+        return (
+            f"HTTP cache: {self.hits} hits, {self.revalidated} revalidated, {self.misses} misses "
+            f"({hit_rate:.1%} served from cache)"
+        )
+
+
+class HttpCache:
+    """
+    `ttl` is the number of seconds an entry is served without revalidation,
+    None for responses that never change, like archived snapshots
+    """
+
+    def __init__(self, path: str = HTTP_CACHE_PATH, ttl: Optional[float] = None) -> None:
+        self.ttl = ttl
+        self.stats = HttpCacheStats()
+        self.db, self.lock = connect_shared(path)
+        # Several collectors may use the cache at the same time
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "url TEXT PRIMARY KEY, status INTEGER NOT NULL, final_url TEXT NOT NULL, headers TEXT NOT NULL, "
+            "body BLOB NOT NULL, size INTEGER NOT NULL, stored_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self.db.commit()
+
+    def get(self, url: str) -> Optional[CachedResponse]:
+        """
+        Looks an entry up without marking it as used, see touch_many
+        """
+        with self.lock:
+            row = self.db.execute(
+                "SELECT status, final_url, headers, body, stored_at FROM responses WHERE url = ?", (normalize_url(url),)
+            ).fetchone()
+        if row is None:
+            return None
+
+        status, final_url, headers, body, stored_at = row
+        content = zstandard.ZstdDecompressor().decompress(body)
+        return CachedResponse(url, status, final_url, json.loads(headers), content, stored_at)
+
+    def is_fresh(self, entry: CachedResponse) -> bool:
+        return self.ttl is None or time.time() - entry.stored_at < self.ttl
+
+    def put(self, url: str, status: int, headers: Dict[str, str], content: bytes, final_url: str = None) -> None:
+        headers = {
+            k: v
+            for k, v in headers.items()
+            if k.lower() not in TRANSFER_HEADERS | PER_REQUEST_HEADERS
+            and not k.lower().startswith(PER_REQUEST_HEADER_PREFIXES)
+        }
+        body = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL).compress(content)
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(url, status, final_url, headers, body, size, stored_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (normalize_url(url), status, final_url or url, json.dumps(headers), body, len(body), now, now),
+            )
+            self.db.commit()
+
+    def touch_many(self, urls: Iterable[str]) -> None:
+        "Marks entries as used in a single transaction, so they are evicted last"
+        now = time.time()
+        with self.lock:
+            self.db.executemany(
+                "UPDATE responses SET accessed_at = ? WHERE url = ?", ((now, normalize_url(url)) for url in urls)
+            )
+            self.db.commit()
+
+    def refresh(self, url: str) -> None:
+        "Marks an entry as fresh again after the server answered 304 Not Modified"
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "UPDATE responses SET stored_at = ?, accessed_at = ? WHERE url = ?", (now, now, normalize_url(url))
+            )
+            self.db.commit()
+
+    def total_bytes(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def evict(self, max_bytes: Optional[int] = None, max_age: Optional[float] = None) -> int:
+        """
+        Removes the entries stored more than `max_age` seconds ago, then the least recently
+        used entries until the cache fits in `max_bytes`. Returns the number of removed entries
+        """
+        n_removed = 0
+        with self.lock:
+            if max_age is not None:
+                n_removed += self.db.execute(
+                    "DELETE FROM responses WHERE stored_at < ?", (time.time() - max_age,)
+                ).rowcount
+
+            if max_bytes is not None:
+                n_removed += evict_least_recently_used(self.db, "responses", "url", max_bytes)
+
+            self.db.commit()
+            if n_removed:
+                self.db.execute("VACUUM")
+        return n_removed
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __enter__(self) -> "HttpCache":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def conditional_headers(entry: CachedResponse) -> Dict[str, str]:
+    """
+    Request headers asking the server to answer 304 if the cached response is still current
+    """
+    headers = {k.lower(): v for k, v in entry.headers.items()}
+    conditions = {}
+    if "etag" in headers:
+        conditions["If-None-Match"] = headers["etag"]
+    if "last-modified" in headers:
+        conditions["If-Modified-Since"] = headers["last-modified"]
+    return conditions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Inspects and trims the shared HTTP cache")
+    parser.add_argument("command", choices=["stats", "evict"])
+    parser.add_argument("--cache", default=HTTP_CACHE_PATH)
+    parser.add_argument("--max-bytes", type=int, help="Size to trim the cache to, least recently used first")
+    parser.add_argument("--max-age", type=float, help="Seconds after which an entry is removed")
+    args = parser.parse_args()
+
+    with HttpCache(args.cache) as cache:
+        if args.command == "evict":
+            print(f"Removed {cache.evict(args.max_bytes, args.max_age)} entries")
+        print(f"{len(cache)} responses, {cache.total_bytes() / 1024**2:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
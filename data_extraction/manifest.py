@@ -0,0 +1,144 @@
+"""
+Persistent download manifest keeping the state of every document in sqlite.
+
+A document moves from pending to fetched (or captcha / failed, which are retried)
+and finally to extracted. Collectors resume from the manifest with an indexed
+query instead of listing their output directories.
+"""
+import argparse
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlite_utils import connect_shared
+
+MANIFEST_PATH = "../data/intermediate/manifest.sqlite"
+
+STATES = ("pending", "fetched", "captcha", "failed", "extracted")
+RETRYABLE_STATES = ("pending", "captcha", "failed")
+
+
+class Manifest:
+    def __init__(self, path: str = MANIFEST_PATH) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db, self.lock = connect_shared(path)
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                id TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                url TEXT NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS documents_source_state ON documents (source, state);
+            """
+        )
+        self.db.commit()
+
+    def add_pending(self, source: str, urls: Dict[str, str]) -> None:
+        """
+        Registers new documents (id -> url) as pending, known ids are left untouched
+        """
+        now = time.time()
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO documents (id, source, url, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                ((i, source, url, now, now) for i, url in urls.items()),
+            )
+            self.db.commit()
+
+    def mark(self, doc_id: str, state: str, error: Optional[str] = None) -> None:
+        self.mark_many([doc_id], state, error)
+
+    def mark_many(self, doc_ids: Iterable[str], state: str, error: Optional[str] = None) -> None:
+        """
+        Moves documents to `state`. Every state but extracted counts as a download attempt
+        """
+        assert state in STATES, f"Unknown state {state}"
+        attempt = int(state not in ("pending", "extracted"))
+        now = time.time()
+        with self.lock:
+            self.db.executemany(
+                "UPDATE documents SET state = ?, error = ?, attempts = attempts + ?, updated_at = ? "
+                "WHERE id = ?",
+                ((state, error, attempt, now, i) for i in doc_ids),
+            )
+            self.db.commit()
+
+    def ids_in_states(self, source: str, states: Iterable[str]) -> List[str]:
+        states = tuple(states)
+        placeholders = ",".join("?" * len(states))
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT id FROM documents WHERE source = ? AND state IN ({placeholders})",
+                (source, *states),
+            )
+            return [row[0] for row in rows]
+
+    def state_counts(self, source: str, doc_ids: Iterable[str]) -> Dict[str, int]:
+        """
+        Number of the given documents in every state
+        """
+        with self.lock:
+            # The ids go through a temporary table and CROSS JOIN makes sqlite look each of them up
+            # by primary key, instead of reading every document of the source
+            self.db.execute("CREATE TEMP TABLE IF NOT EXISTS counted_ids (id TEXT PRIMARY KEY)")
+            self.db.execute("DELETE FROM counted_ids")
+            self.db.executemany("INSERT OR IGNORE INTO counted_ids (id) VALUES (?)", ((i,) for i in doc_ids))
+            rows = self.db.execute(
+                "SELECT state, COUNT(*) FROM counted_ids CROSS JOIN documents USING (id) "
+                "WHERE source = ? GROUP BY state",
+                (source,),
+            ).fetchall()
+            self.db.commit()
+        return dict(rows)
+
+    def pending_ids(self, source: str) -> List[str]:
+        "Ids that still have to be downloaded"
+        return self.ids_in_states(source, RETRYABLE_STATES)
+
+    def downloaded_ids(self, source: str) -> List[str]:
+        return self.ids_in_states(source, ("fetched", "extracted"))
+
+    def status(self) -> List[Tuple[str, str, int, float]]:
+        """
+        Returns (source, state, count, mean attempts) for every source and state
+        """
+        with self.lock:
+            return self.db.execute(
+                "SELECT source, state, COUNT(*), AVG(attempts) FROM documents "
+                "GROUP BY source, state ORDER BY source, state"
+            ).fetchall()
+
+    def close(self) -> None:
+        self.db.close()
+
+
+def print_status(manifest: Manifest) -> None:
+    rows = manifest.status()
+    if not rows:
+        print("The manifest is empty")
+        return
+
+    print(f"{'source':<15}{'state':<12}{'count':>10}{'attempts':>10}")
+    for source, state, count, attempts in rows:
+        print(f"{source:<15}{state:<12}{count:>10}{attempts:>10.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Inspects the download manifest")
+    parser.add_argument("command", choices=["status"])
+    parser.add_argument("--manifest", default=MANIFEST_PATH)
+    args = parser.parse_args()
+
+    if args.command == "status":
+        print_status(Manifest(args.manifest))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Performance and data loss metrics of the pipeline stages, configured in the [metrics] section of config.toml.
+
+Every stage run appends one record to a JSONL run log: wall and cpu time, peak RSS,
+rows in and out, rows per second and the number of rows dropped for each reason.
+When a textfile directory is configured, the latest run of every stage is also written
+in the Prometheus text format, for the node_exporter textfile collector.
+
+    python metrics.py summary    # latest run of every stage
+"""
+import argparse
+import json
+import os
+import resource
+import time
+import uuid
+from collections import Counter
+from typing import Dict, List, Optional
+
+from common import read_config
+from manifest import RETRYABLE_STATES, Manifest
+
+MODULE_NAME = "metrics"
+# Set by run_pipeline so the stages of one pipeline run share a run id
+RUN_ID_VARIABLE = "SYAC_RUN_ID"
+PROMETHEUS_PREFIX = "syac_stage"
+
+
+def cpu_seconds() -> float:
+    """
+    Cpu time of this process and its finished child processes, such as worker pools
+    """
+    usage = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    return sum(u.ru_utime + u.ru_stime for u in usage)
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on linux
+    usage = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    return max(u.ru_maxrss for u in usage) / 1024
+
+
+class StageMetrics:
+    """
+    Collects the metrics of one stage run and reports them when the stage exits
+
+        with StageMetrics("filter_urls") as metrics:
+            metrics.rows_in = len(df)
+            metrics.drop("blacklisted_domain", n_blacklisted)
+            metrics.rows_out = len(new_df)
+    """
+
+    def __init__(self, stage: str, config: Optional[Dict] = None) -> None:
+        self.stage = stage
+        self.config = config if config is not None else read_config([MODULE_NAME])[MODULE_NAME]
+        self.rows_in = 0
+        self.rows_out = 0
+        self.dropped: Counter = Counter()
+
+    def drop(self, reason: str, n_rows: int) -> None:
+        if n_rows:
+            self.dropped[reason] += n_rows
+
+    def __enter__(self) -> "StageMetrics":
+        self.started_at = time.time()
+        self.wall_before = time.perf_counter()
+        self.cpu_before = cpu_seconds()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        wall_seconds = time.perf_counter() - self.wall_before
+        record = {
+            "run_id": os.environ.get(RUN_ID_VARIABLE) or uuid.uuid4().hex,
+            "stage": self.stage,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+            "status": "ok" if exc_type is None else "failed",
+            "wall_seconds": round(wall_seconds, 3),
+            "cpu_seconds": round(cpu_seconds() - self.cpu_before, 3),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "rows_per_second": round(self.rows_in / wall_seconds, 1) if wall_seconds else None,
+            "dropped": dict(self.dropped),
+        }
+
+        append_run_log(self.config["run_log_path"], record)
+        if self.config["prometheus_textfile_dir"]:
+            write_prometheus_textfile(self.config["prometheus_textfile_dir"], record)
+
+
+def record_download_metrics(metrics: StageMetrics, manifest: Manifest, source: str, doc_ids) -> None:
+    """
+    Counts the documents of a download run that were fetched, and the ones
+    left in a retryable manifest state as dropped. Called once per source
+    """
+    counts = manifest.state_counts(source, doc_ids)
+    metrics.rows_out += counts.get("fetched", 0)
+    for state in RETRYABLE_STATES:
+        metrics.drop(f"download_{state}", counts.get(state, 0))
+
+
+def append_run_log(path: str, record: Dict) -> None:
+    with open(path, "a", encoding="UTF8") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def read_run_log(path: str) -> List[Dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="UTF8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_prometheus_textfile(directory: str, record: Dict) -> None:
+    """
+    Writes the record to <directory>/syac_<stage>.prom, replacing the previous run of the stage.
+    The file is renamed into place so the collector never reads a partial file
+    """
+    labels = f'stage="{record["stage"]}"'
+    gauges = {
+        "wall_seconds": record["wall_seconds"],
+        "cpu_seconds": record["cpu_seconds"],
+        "peak_rss_mb": record["peak_rss_mb"],
+        "rows_in": record["rows_in"],
+        "rows_out": record["rows_out"],
+        "rows_per_second": record["rows_per_second"] or 0,
+        "success": int(record["status"] == "ok"),
+        "last_run_timestamp_seconds": int(time.time()),
+    }
+
+    lines = []
+    for name, value in gauges.items():
+        lines += [f"# TYPE {PROMETHEUS_PREFIX}_{name} gauge", f"{PROMETHEUS_PREFIX}_{name}{{{labels}}} {value}"]
+    lines.append(f"# TYPE {PROMETHEUS_PREFIX}_rows_dropped gauge")
+    for reason, n_rows in record["dropped"].items():
+        lines.append(f'{PROMETHEUS_PREFIX}_rows_dropped{{{labels},reason="{reason}"}} {n_rows}')
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"syac_{record['stage']}.prom")
+    with open(path + ".tmp", "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(path + ".tmp", path)
+
+
+def print_summary(records: List[Dict]) -> None:
+    """
+    Prints the latest run of every stage
+    """
+    latest = {}
+    for record in records:
+        latest[record["stage"]] = record
+
+    for record in latest.values():
+        print(
+            f"{record['stage']:<32}{record['status']:<8}{record['wall_seconds']:>10.1f}s"
+            f"{record['rows_in']:>10} in{record['rows_out']:>10} out"
+        )
+        for reason, n_rows in sorted(record["dropped"].items(), key=lambda r: -r[1]):
+            print(f"{'':<40}{n_rows:>10} {reason}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Shows the metrics of the pipeline stages")
+    parser.add_argument("command", choices=["summary"])
+    args = parser.parse_args()
+
+    if args.command == "summary":
+        config = read_config([MODULE_NAME])[MODULE_NAME]
+        print_summary(read_run_log(config["run_log_path"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Near-duplicate detection of article bodies with MinHash signatures and
+locality sensitive hashing (LSH), configured in the [clean_dataset] section of config.toml.
+
+Documents are added in dataset order and a document is a duplicate when its estimated
+Jaccard similarity to an earlier kept document reaches the threshold, so like
+drop_duplicates the first post of every cluster is kept.
+"""
+import multiprocessing
+import zlib
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+SHINGLE_HASH_MULTIPLIER = np.uint64(1_000_003)
+SEED = 1
+# Documents with fewer rows are hashed in the main process
+PARALLEL_MIN_DOCS = 10_000
+
+
+def shingle_hashes(text: str, shingle_size: int) -> np.ndarray:
+    """
+    32 bit hashes of the distinct word `shingle_size`-grams of the text.
+    Texts shorter than one shingle are a single shingle
+    """
+    words = text.split()
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+
+    word_hashes = np.array([zlib.crc32(w.encode("UTF8")) for w in words], dtype=np.uint64)
+    n_shingles = max(1, len(words) - shingle_size + 1)
+    hashes = np.zeros(n_shingles, dtype=np.uint64)
+    # Polynomial rolling hash over the words of every shingle, wrapping around at 2^64
+    for offset in range(min(shingle_size, len(words))):
+        hashes = hashes * SHINGLE_HASH_MULTIPLIER + word_hashes[offset : offset + n_shingles]
+    return np.unique(hashes & MAX_HASH)
+
+
+def make_permutations(num_perm: int) -> Tuple[np.ndarray, np.ndarray]:
+    rng = np.random.RandomState(SEED)
+    a = rng.randint(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    b = rng.randint(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash_signature(text: str, shingle_size: int, permutations: Tuple[np.ndarray, np.ndarray]) -> Optional[np.ndarray]:
+    """
+    MinHash signature of the shingles of the text, None for texts without words
+    """
+    hashes = shingle_hashes(text, shingle_size)
+    if len(hashes) == 0:
+        return None
+
+    a, b = permutations
+    permuted = ((np.outer(a, hashes) + b[:, None]) % MERSENNE_PRIME) & MAX_HASH
+    return permuted.min(axis=1).astype(np.uint32)
+
+
+# Set in each worker by init_worker
+_shingle_size = 0
+_permutations: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+
+def init_worker(shingle_size: int, num_perm: int) -> None:
+    global _shingle_size, _permutations
+    _shingle_size = shingle_size
+    _permutations = make_permutations(num_perm)
+
+
+def worker_signature(text: str) -> Optional[np.ndarray]:
+    return minhash_signature(text, _shingle_size, _permutations)
+
+
+def lsh_parameters(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """
+    Number of bands and rows per band whose S-curve midpoint (1/bands)^(1/rows) is the
+    closest below the threshold. Erring low only costs extra candidate checks, while
+    erring high would miss duplicates
+    """
+    candidates = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+    below = [p for p in candidates if (1 / p[0]) ** (1 / p[1]) <= threshold] or [(num_perm, 1)]
+    return max(below, key=lambda p: (1 / p[0]) ** (1 / p[1]))
+
+
+class Duplicate(NamedTuple):
+    id: str
+    # Id of the earlier kept post
+    duplicate_of: str
+    similarity: float
+
+
+class NearDuplicateIndex:
+    """
+    Streaming LSH index of the kept documents. Only kept documents are indexed,
+    so memory grows with the number of distinct articles
+    """
+
+    def __init__(self, threshold: float, shingle_size: int, num_perm: int, n_cores: int = None) -> None:
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.num_perm = num_perm
+        self.n_cores = n_cores or multiprocessing.cpu_count()
+        self.bands, self.rows = lsh_parameters(threshold, num_perm)
+        self.permutations = make_permutations(num_perm)
+        self.buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(self.bands)]
+        self.kept_ids: List[str] = []
+        self.kept_signatures: List[np.ndarray] = []
+        self.duplicates: List[Duplicate] = []
+
+    @classmethod
+    def from_config(cls, config) -> "NearDuplicateIndex":
+        return cls(
+            config["near_duplicate_threshold"], config["near_duplicate_shingle_size"], config["near_duplicate_num_perm"]
+        )
+
+    def signatures(self, texts: List[str]) -> Iterable[Optional[np.ndarray]]:
+        if len(texts) < PARALLEL_MIN_DOCS:
+            return [minhash_signature(t, self.shingle_size, self.permutations) for t in texts]
+
+        chunksize = max(1, len(texts) // (self.n_cores * 8))
+        with multiprocessing.Pool(self.n_cores, init_worker, (self.shingle_size, self.num_perm)) as pool:
+            return pool.map(worker_signature, texts, chunksize)
+
+    def band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[i * self.rows : (i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def find(self, signature: np.ndarray, keys: List[bytes]) -> Optional[Tuple[int, float]]:
+        """
+        Returns the earliest kept document similar to the signature and their estimated similarity
+        """
+        candidates = {c for band, key in zip(self.buckets, keys) for c in band.get(key, ())}
+        for candidate in sorted(candidates):
+            similarity = float(np.mean(self.kept_signatures[candidate] == signature))
+            if similarity >= self.threshold:
+                return candidate, similarity
+        return None
+
+    def add_many(self, ids: Iterable[str], texts: List[str]) -> List[bool]:
+        """
+        Adds documents in order and returns for each whether it is kept
+        """
+        keep = []
+        for doc_id, signature in zip(ids, self.signatures(texts)):
+            if signature is None:
+                keep.append(True)
+                continue
+
+            keys = self.band_keys(signature)
+            match = self.find(signature, keys)
+            if match is not None:
+                candidate, similarity = match
+                self.duplicates.append(Duplicate(doc_id, self.kept_ids[candidate], round(similarity, 4)))
+                keep.append(False)
+                continue
+
+            position = len(self.kept_ids)
+            self.kept_ids.append(doc_id)
+            self.kept_signatures.append(signature)
+            for band, key in zip(self.buckets, keys):
+                band.setdefault(key, []).append(position)
+            keep.append(True)
+        return keep
+
+    def clusters(self) -> Dict[str, List[str]]:
+        """
+        Ids of the removed duplicates, grouped by the id of the kept post
+        """
+        clusters = {}
+        for duplicate in self.duplicates:
+            clusters.setdefault(duplicate.duplicate_of, []).append(duplicate.id)
+        return clusters
+
+
+def write_duplicates(path: str, duplicates: List[Duplicate]) -> None:
+    """
+    Writes one row per removed post with the post it duplicates
+    """
+    with open(path, "w", encoding="UTF8") as f:
+        f.write("post_id\tduplicate_of\tsimilarity\n")
+        for duplicate in duplicates:
+            f.write(f"{duplicate.id}\t{duplicate.duplicate_of}\t{duplicate.similarity}\n")
@@ -0,0 +1,279 @@
+"""
+Runs the data_extraction stages in dependency order and skips every stage whose
+inputs, code and config sections are unchanged since its last successful run.
+Stages that do not depend on each other run in parallel.
+
+    python run_pipeline.py                      # run the stages that are out of date
+    python run_pipeline.py --dry-run            # only show what would run
+    python run_pipeline.py --force filter_urls  # rerun a stage and everything after it
+"""
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import uuid
+from typing import Dict, List, NamedTuple, Set
+
+import toml
+
+from common import CONFIG_PATH
+from metrics import RUN_ID_VARIABLE
+
+STATE_PATH = "../data/intermediate/pipeline_state.json"
+HASH_BLOCK_SIZE = 1 << 20
+
+
+class Stage(NamedTuple):
+    name: str
+    script: str
+    inputs: List[str]
+    # Files or directories, a stage reruns when one of them is missing
+    outputs: List[str]
+    config_sections: List[str]
+    # Local modules the script depends on, besides the script itself
+    modules: List[str]
+
+
+def declare_stages(config: Dict) -> List[Stage]:
+    clean_config = config["clean_dataset"]
+    split_config = config["split_dataset"]
+    return [
+        Stage(
+            "download_urls",
+            "download_urls.py",
+            [],
+            ["../data/intermediate/syac_urls_raw.parquet"],
+            ["download_urls"],
+            ["common.py", "metrics.py"],
+        ),
+        Stage(
+            "filter_urls",
+            "filter_urls.py",
+            ["../data/intermediate/syac_urls_raw.parquet"],
+            ["../data/intermediate/archivetoday_urls.parquet", "../data/intermediate/webarchive_urls.parquet"],
+            ["filter_urls"],
+            ["common.py", "metrics.py"],
+        ),
+        Stage(
+            "download_documents",
+            "download_documents.py",
+            ["../data/intermediate/webarchive_urls.parquet", "../data/intermediate/archivetoday_urls.parquet"],
+            ["dataset_raw/webarchive", "dataset_raw/archivetoday"],
+            [],
+            [
+                "common.py", "downloads.py", "driver_pool.py", "fetcher.py", "html_store.py", "http_cache.py",
+                "manifest.py", "metrics.py", "sqlite_utils.py", "warc_store.py", "wayback.py",
+            ],
+        ),
+        Stage(
+            "extract_documents",
+            "extract_documents.py",
+            [
+                "../data/intermediate/webarchive_urls.parquet",
+                "../data/intermediate/archivetoday_urls.parquet",
+                "dataset_raw/webarchive/index.sqlite",
+                "dataset_raw/archivetoday/index.sqlite",
+            ],
+            ["../data/syac_dataset_raw.parquet"],
+            ["extract_documents"],
+            [
+                "common.py", "extraction_cache.py", "extractors.py", "html_store.py", "manifest.py", "metrics.py",
+                "sqlite_utils.py", "warc_store.py",
+            ],
+        ),
+        Stage(
+            "clean_dataset",
+            "clean_dataset.py",
+            [clean_config["dirty_dataset_path"], clean_config["profanity_annotations_path"]],
+            [clean_config["clean_dataset_path"]],
+            ["clean_dataset", "datapaths"],
+            ["common.py", "metrics.py", "near_duplicates.py"],
+        ),
+        Stage(
+            "split_dataset",
+            "split_dataset.py",
+            [config["datapaths"]["dataset_path"], split_config["train_val_test_id_path"]],
+            [split_config["train_path"], split_config["val_path"], split_config["test_path"]],
+            ["split_dataset", "datapaths", "clean_dataset"],
+            ["common.py", "metrics.py"],
+        ),
+    ]
+
+
+def is_within(path: str, directory: str) -> bool:
+    path, directory = os.path.normpath(path), os.path.normpath(directory)
+    return path == directory or path.startswith(directory + os.sep)
+
+
+def get_dependencies(stages: List[Stage]) -> Dict[str, Set[str]]:
+    """
+    A stage depends on every stage producing one of its inputs
+    """
+    return {
+        stage.name: {
+            other.name
+            for other in stages
+            if other is not stage and any(is_within(i, o) for i in stage.inputs for o in other.outputs)
+        }
+        for stage in stages
+    }
+
+
+class FileHasher:
+    """
+    Content hashes of files, cached by size and modification time so
+    unchanged inputs are not read again on the next run
+    """
+
+    def __init__(self, known: Dict[str, List]) -> None:
+        self.known = known
+
+    def hash(self, path: str) -> str:
+        if not os.path.exists(path):
+            return "missing"
+
+        stat = os.stat(path)
+        cached = self.known.get(path)
+        if cached and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return cached[2]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+                digest.update(block)
+        self.known[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+
+def fingerprint(stage: Stage, config: Dict, hasher: FileHasher) -> str:
+    """
+    Hash of everything a stage's output depends on: its input files, its code
+    and the config sections it reads
+    """
+    parts = {
+        "inputs": {path: hasher.hash(path) for path in stage.inputs},
+        "code": {path: hasher.hash(path) for path in [stage.script, *stage.modules]},
+        "config": {section: config.get(section) for section in stage.config_sections},
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("UTF8")).hexdigest()
+
+
+def is_up_to_date(stage: Stage, state: Dict, current_fingerprint: str) -> bool:
+    return state["stages"].get(stage.name) == current_fingerprint and all(os.path.exists(o) for o in stage.outputs)
+
+
+def read_state(path: str) -> Dict:
+    if not os.path.exists(path):
+        return {"stages": {}, "files": {}}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def write_state(path: str, state: Dict) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def run_stage(stage: Stage) -> int:
+    print(f"[run] {stage.name}")
+    return subprocess.run([sys.executable, stage.script]).returncode
+
+
+def run_pipeline(stages: List[Stage], config: Dict, forced: Set[str], dry_run: bool = False) -> bool:
+    """
+    Starts every stage as soon as the stages it depends on have finished.
+    Returns False when a stage failed, its dependent stages are not run
+    """
+    state = read_state(STATE_PATH)
+    hasher = FileHasher(state["files"])
+    dependencies = get_dependencies(stages)
+
+    done: Set[str] = set()
+    rerun: Set[str] = set()
+    failed: Set[str] = set()
+    running: Dict[concurrent.futures.Future, str] = {}
+    fingerprints: Dict[str, str] = {}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(stages)) as executor:
+        while True:
+            waiting = [s for s in stages if s.name not in done | failed and s.name not in running.values()]
+            n_waiting = len(waiting)
+            for stage in waiting:
+                if dependencies[stage.name] & failed:
+                    print(f"[skip] {stage.name}, an upstream stage failed")
+                    failed.add(stage.name)
+                    continue
+                if not dependencies[stage.name] <= done:
+                    continue
+
+                # Inputs are only hashed once the stages producing them have finished
+                fingerprints[stage.name] = fingerprint(stage, config, hasher)
+                # A dry run cannot know whether upstream stages would change their outputs
+                forced_run = stage.name in forced or (dry_run and dependencies[stage.name] & rerun)
+                if not forced_run and is_up_to_date(stage, state, fingerprints[stage.name]):
+                    print(f"[up to date] {stage.name}")
+                    done.add(stage.name)
+                elif dry_run:
+                    print(f"[would run] {stage.name}")
+                    done.add(stage.name)
+                    rerun.add(stage.name)
+                else:
+                    running[executor.submit(run_stage, stage)] = stage.name
+
+            if not running:
+                if len(done | failed) == len(stages):
+                    break
+                if len(stages) - len(done | failed) == n_waiting:
+                    raise RuntimeError("Stages depend on each other in a cycle")
+                continue
+
+            finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                if future.result() != 0:
+                    print(f"[failed] {name} exited with code {future.result()}")
+                    failed.add(name)
+                    continue
+
+                state["stages"][name] = fingerprints[name]
+                write_state(STATE_PATH, state)
+                done.add(name)
+
+    return not failed
+
+
+def with_downstream(names: Set[str], stages: List[Stage]) -> Set[str]:
+    dependencies = get_dependencies(stages)
+    result = set(names)
+    changed = True
+    while changed:
+        changed = False
+        for stage in stages:
+            if stage.name not in result and dependencies[stage.name] & result:
+                result.add(stage.name)
+                changed = True
+    return result
+
+
+def main() -> None:
+    config = toml.load(CONFIG_PATH)
+    stages = declare_stages(config)
+
+    parser = argparse.ArgumentParser(description="Runs the out of date data_extraction stages")
+    parser.add_argument("--force", nargs="+", default=[], choices=[s.name for s in stages], help="Stages to rerun")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    # The stages started by this run report their metrics under one run id
+    os.environ[RUN_ID_VARIABLE] = uuid.uuid4().hex
+    if not run_pipeline(stages, config, with_downstream(set(args.force), stages), args.dry_run):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,11 @@
 import os
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import pandas as pd
 from sklearn.model_selection import train_test_split
 
-from common import read_config
+from common import read_config, read_table, write_table
+from metrics import StageMetrics
 
 MODULE_NAME = "split_dataset"
 
@@ -47,15 +48,25 @@ def split_df(df: pd.DataFrame) -> Tuple[pd.DataFrame]:
 
 
 def load_dfs_from_ids(
-    df: pd.DataFrame, train_ids: List[str], val_ids: List[str], test_ids: List[str]
+    df: pd.DataFrame,
+    train_ids: List[str],
+    val_ids: List[str],
+    test_ids: List[str],
+    allow_missing: bool = False,
 ) -> Tuple[pd.DataFrame]:
     """
-    Extrait train-val-test splits from lists of ids
+    Extrait train-val-test splits from lists of ids.
+    Ids that are not in the dataset raise a KeyError, as the splits would no longer match
+    the published ones, unless `allow_missing` is set: then they are left out
     """
+    missing = pd.Index([*train_ids, *val_ids, *test_ids]).difference(df.index)
+    if len(missing) and not allow_missing:
+        raise KeyError(f"{len(missing)} ids of the id file are not in the dataset, e.g. {list(missing[:5])}")
 
-    train_set = df.loc[train_ids]
-    val_set = df.loc[val_ids]
-    test_set = df.loc[test_ids]
+    # Keeps the order of the id file
+    train_set = df.loc[pd.Index(train_ids).intersection(df.index, sort=False)]
+    val_set = df.loc[pd.Index(val_ids).intersection(df.index, sort=False)]
+    test_set = df.loc[pd.Index(test_ids).intersection(df.index, sort=False)]
 
     return train_set, val_set, test_set
 
@@ -89,34 +100,53 @@ def split_dataset(
     expected_datasplit_id_path: str,
     backup_datasplit_id_path: str,
     split_paths: Dict[str, str],
+    metrics: Optional[StageMetrics] = None,
+    allow_missing_ids: bool = False,
 ) -> None:
     """
-    Splits the dataset to a training set, validation set and test set
+    Splits the dataset to a training set, validation set and test set.
+    `allow_missing_ids` is for datasets that an earlier stage removed posts from, such as near-duplicates
     """
-    df = pd.read_csv(dataset_path, index_col=0, sep="\t")
+    df = read_table(dataset_path)
 
     if os.path.exists(expected_datasplit_id_path):
         ids = read_ids(expected_datasplit_id_path)
     else:
         ids = handle_missing_id_path(df, backup_datasplit_id_path)
 
-    train_set, val_set, test_set = load_dfs_from_ids(df, *ids)
+    train_set, val_set, test_set = load_dfs_from_ids(df, *ids, allow_missing=allow_missing_ids)
 
-    train_set.to_csv(split_paths["train_path"], sep="\t")
-    val_set.to_csv(split_paths["val_path"], sep="\t")
-    test_set.to_csv(split_paths["test_path"], sep="\t")
+    write_table(train_set, split_paths["train_path"])
+    write_table(val_set, split_paths["val_path"])
+    write_table(test_set, split_paths["test_path"])
+
+    n_split = len(train_set) + len(val_set) + len(test_set)
+    n_missing = sum(map(len, ids)) - n_split
+    if n_missing:
+        print(f"WARNING: {n_missing} ids of the id file are not in the dataset")
+
+    if metrics is not None:
+        metrics.rows_in = len(df)
+        metrics.rows_out = n_split
+        metrics.drop("not_in_split_ids", len(df) - n_split)
+        # Ids removed by an earlier stage, such as near-duplicates
+        metrics.drop("split_id_not_in_dataset", n_missing)
 
 
 def main() -> None:
-    config = read_config([MODULE_NAME, "datapaths"])
+    config = read_config([MODULE_NAME, "datapaths", "clean_dataset"])
     module_config = config[MODULE_NAME]
 
-    split_dataset(
-        dataset_path=config["datapaths"]["dataset_path"],
-        expected_datasplit_id_path=module_config["train_val_test_id_path"],
-        backup_datasplit_id_path=module_config["train_val_test_id_local_path"],
-        split_paths=module_config,
-    )
+    with StageMetrics(MODULE_NAME) as metrics:
+        split_dataset(
+            dataset_path=config["datapaths"]["dataset_path"],
+            expected_datasplit_id_path=module_config["train_val_test_id_path"],
+            backup_datasplit_id_path=module_config["train_val_test_id_local_path"],
+            split_paths=module_config,
+            metrics=metrics,
+            # Removing near-duplicates removes posts of the published splits
+            allow_missing_ids=config["clean_dataset"]["remove_near_duplicates"],
+        )
 
 
 if __name__ == "__main__":
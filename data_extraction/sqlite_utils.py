@@ -0,0 +1,37 @@
+"""
+Helpers shared by the sqlite backed stores: the html store index, the download
+manifest and the extraction and HTTP caches
+"""
+import sqlite3
+import threading
+from typing import Tuple
+
+
+def connect_shared(path: str) -> Tuple[sqlite3.Connection, threading.Lock]:
+    """
+    Opens a connection that can be used from several threads, like the drivers of the
+    driver pool or the download backends running side by side, together with the lock
+    that every use of the connection has to hold
+    """
+    return sqlite3.connect(path, check_same_thread=False), threading.Lock()
+
+
+def evict_least_recently_used(db: sqlite3.Connection, table: str, key_column: str, max_bytes: int) -> int:
+    """
+    Deletes the least recently used rows of `table` until the size of the remaining rows
+    is at most `max_bytes`. The table needs size and accessed_at columns. Returns the
+    number of deleted rows, the caller commits
+    """
+    excess = db.execute(f"SELECT COALESCE(SUM(size), 0) FROM {table}").fetchone()[0] - max_bytes
+    if excess <= 0:
+        return 0
+
+    keys = []
+    for key, size in db.execute(f"SELECT {key_column}, size FROM {table} ORDER BY accessed_at"):
+        keys.append((key,))
+        excess -= size
+        if excess <= 0:
+            break
+
+    db.executemany(f"DELETE FROM {table} WHERE {key_column} = ?", keys)
+    return len(keys)
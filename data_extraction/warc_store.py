@@ -0,0 +1,153 @@
+"""
+Rolling, gzip compressed WARC output for the collectors and a streaming WARC reader.
+
+Every record carries the reddit post id in the WARC-Syac-Post-Id header, so
+pages can be matched to posts without a separate index.
+"""
+import glob
+import os
+import threading
+import time
+from http.client import responses as http_reasons
+from io import BytesIO
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+from urllib.parse import urlsplit
+
+from warcio.archiveiterator import ArchiveIterator
+from warcio.statusandheaders import StatusAndHeaders
+from warcio.warcwriter import WARCWriter
+
+POST_ID_HEADER = "WARC-Syac-Post-Id"
+MAX_RECORDS_PER_FILE = 2000
+
+# The body is stored decoded, so headers describing the transfer encoding no longer apply
+DROPPED_HEADERS = {"content-encoding", "transfer-encoding", "content-length"}
+
+
+class RollingWarcWriter:
+    """
+    Writes request/response records to gzip compressed WARC files,
+    starting a new file every `max_records` pages
+    """
+
+    def __init__(self, directory: str, prefix: str, max_records: int = MAX_RECORDS_PER_FILE) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.prefix = prefix
+        self.max_records = max_records
+        self.lock = threading.Lock()
+        self.file = None
+        self.writer = None
+        self.n_records = 0
+        self.n_files = 0
+
+    def _rotate(self) -> None:
+        if self.file is not None:
+            self.file.close()
+
+        timestamp = time.strftime("%Y%m%d%H%M%S")
+        path = os.path.join(self.directory, f"{self.prefix}-{timestamp}-{self.n_files:05d}.warc.gz")
+        self.file = open(path, "wb")
+        self.writer = WARCWriter(self.file, gzip=True)
+        self.n_records = 0
+        self.n_files += 1
+
+    def _current_writer(self) -> WARCWriter:
+        "Returns the writer of the current file, rotating when it is full. Requires the lock"
+        if self.writer is None or self.n_records >= self.max_records:
+            self._rotate()
+        self.n_records += 1
+        return self.writer
+
+    def write_response(
+        self, doc_id: str, url: str, status: int, headers: Dict[str, str], content: bytes
+    ) -> None:
+        """
+        Writes a response record and the request record that produced it
+        """
+        http_headers = StatusAndHeaders(
+            f"{status} {http_reasons.get(status, '')}".strip(),
+            [(k, v) for k, v in headers.items() if k.lower() not in DROPPED_HEADERS],
+            protocol="HTTP/1.1",
+        )
+        parts = urlsplit(url)
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        request_headers = StatusAndHeaders(
+            f"GET {path or '/'} HTTP/1.1", [("Host", parts.netloc)], is_http_request=True
+        )
+
+        with self.lock:
+            writer = self._current_writer()
+            response = writer.create_warc_record(
+                url,
+                "response",
+                payload=BytesIO(content),
+                http_headers=http_headers,
+                warc_headers_dict={POST_ID_HEADER: doc_id},
+            )
+            request = writer.create_warc_record(
+                url,
+                "request",
+                http_headers=request_headers,
+                warc_headers_dict={
+                    POST_ID_HEADER: doc_id,
+                    "WARC-Concurrent-To": response.rec_headers.get_header("WARC-Record-ID"),
+                },
+            )
+            writer.write_record(response)
+            writer.write_record(request)
+            self.file.flush()
+
+    def write_resource(self, doc_id: str, url: str, content: bytes) -> None:
+        """
+        Writes a page without HTTP headers, like the page source of a selenium driver
+        """
+        with self.lock:
+            writer = self._current_writer()
+            record = writer.create_warc_record(
+                url,
+                "resource",
+                payload=BytesIO(content),
+                warc_content_type="text/html; charset=utf-8",
+                warc_headers_dict={POST_ID_HEADER: doc_id},
+            )
+            writer.write_record(record)
+            self.file.flush()
+
+    def close(self) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+                self.writer = None
+
+    def __enter__(self) -> "RollingWarcWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def list_warc_files(directory: str) -> Iterable[str]:
+    return sorted(glob.glob(os.path.join(directory, "*.warc.gz")))
+
+
+def iter_warc_documents(paths: Iterable[str], ids: Optional[set] = None) -> Iterator[Tuple[str, bytes]]:
+    """
+    Streams (post id, page body) pairs from WARC files, optionally only for `ids`.
+    Later records of the same post override earlier ones when collected in a dict
+    """
+    for path in paths:
+        with open(path, "rb") as f:
+            for record in ArchiveIterator(f):
+                if record.rec_type not in ("response", "resource"):
+                    continue
+
+                doc_id = record.rec_headers.get_header(POST_ID_HEADER)
+                if doc_id is None or (ids is not None and doc_id not in ids):
+                    continue
+
+                if record.http_headers is not None and record.http_headers.get_statuscode() != "200":
+                    continue
+
+                yield doc_id, record.content_stream().read()
@@ -0,0 +1,129 @@
+"""
+Helpers for web.archive (Wayback Machine) snapshot urls
+"""
+import json
+import logging
+import re
+from collections import defaultdict
+from typing import Dict, NamedTuple, Optional
+from urllib.parse import urlencode
+
+from fetcher import FetchResult, fetch_all
+
+SNAPSHOT_URL_PATTERN = re.compile(
+    r"^(?P<prefix>https?://web\.archive\.org/web/)(?P<timestamp>\d{1,14})(?P<modifier>[a-z]{2}_)?/(?P<original>.+)$"
+)
+
+# The rewritten page with the Wayback toolbar, injected scripts and rewritten links
+REWRITTEN_MODE = "rewritten"
+# The original bytes as they were archived
+RAW_MODE = "raw"
+
+CDX_ENDPOINT = "https://web.archive.org/cdx/search/cdx"
+
+
+class Snapshot(NamedTuple):
+    timestamp: str
+    original: str
+
+
+def parse_snapshot_url(url: str) -> Optional[Snapshot]:
+    match = SNAPSHOT_URL_PATTERN.match(url)
+    if match is None:
+        return None
+    return Snapshot(match["timestamp"], match["original"])
+
+
+def to_raw_snapshot_url(url: str) -> str:
+    """
+    Rewrites a snapshot url to its raw id_ form:
+    https://web.archive.org/web/20180101000000/http://a.com -> https://web.archive.org/web/20180101000000id_/http://a.com
+    Urls that are not Wayback snapshots are returned unchanged
+    """
+    match = SNAPSHOT_URL_PATTERN.match(url)
+    if match is None:
+        return url
+    return f"{match['prefix']}{match['timestamp']}id_/{match['original']}"
+
+
+def snapshot_urls(urls, mode: str):
+    """
+    Maps a pandas Series of snapshot urls to the requested snapshot mode
+    """
+    if mode == RAW_MODE:
+        return urls.map(to_raw_snapshot_url)
+    if mode == REWRITTEN_MODE:
+        return urls
+    raise ValueError(f"Unknown snapshot mode {mode}")
+
+
+def cdx_query_url(snapshot: Snapshot, endpoint: str = CDX_ENDPOINT) -> str:
+    """
+    CDX query for the successful capture of the original url closest to the snapshot timestamp
+    """
+    params = {
+        "url": snapshot.original,
+        "output": "json",
+        "fl": "timestamp,original,statuscode",
+        "filter": "statuscode:200",
+        "closest": snapshot.timestamp,
+        "sort": "closest",
+        "limit": 1,
+    }
+    return f"{endpoint}?{urlencode(params)}"
+
+
+def resolve_snapshots(
+    urls: Dict[str, str], endpoint: str = CDX_ENDPOINT, **fetch_kwargs
+) -> Dict[str, str]:
+    """
+    Resolves snapshot urls (id -> url) in bulk through the CDX API.
+    Every url is replaced by the closest capture that answered 200, identical snapshots
+    are only queried once and ids without any successful capture are left out.
+    Urls that are not snapshots, or whose query failed, are kept as they are.
+    """
+    resolved = {}
+    ids_by_snapshot = defaultdict(list)
+
+    for i, url in urls.items():
+        snapshot = parse_snapshot_url(url)
+        if snapshot is None:
+            resolved[i] = url
+        else:
+            ids_by_snapshot[snapshot].append(i)
+
+    snapshots = list(ids_by_snapshot)
+    queries = {str(n): cdx_query_url(snapshot, endpoint) for n, snapshot in enumerate(snapshots)}
+
+    def handle_result(result: FetchResult) -> None:
+        snapshot = snapshots[int(result.id)]
+        ids = ids_by_snapshot.pop(snapshot)
+
+        if result.status != 200:
+            logging.warning(f" CDX query for {snapshot.original} answered {result.status}")
+            resolved.update((i, urls[i]) for i in ids)
+            return
+
+        try:
+            # The first row is the header: ["timestamp", "original", "statuscode"]
+            rows = json.loads(result.content or b"[]")[1:]
+        except ValueError as e:
+            logging.warning(f" Malformed CDX response for {snapshot.original}: {e}")
+            resolved.update((i, urls[i]) for i in ids)
+            return
+
+        if not rows:
+            return
+
+        timestamp, original, _ = rows[0]
+        resolved.update((i, f"https://web.archive.org/web/{timestamp}/{original}") for i in ids)
+
+    fetch_all(queries, handle_result, **fetch_kwargs)
+
+    # Queries that were given up on because of connection errors
+    for ids in ids_by_snapshot.values():
+        resolved.update((i, urls[i]) for i in ids)
+
+    n_missing = len(urls) - len(resolved)
+    logging.info(f" Resolved {len(snapshots)} snapshots, {n_missing} urls have no successful capture")
+    return resolved
@@ -0,0 +1,24 @@
+"""
+Shared fixtures: the data_extraction modules on the path and a local stub HTTP server
+"""
+import http.server
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Type
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data_extraction"))
+
+
+@contextmanager
+def serve(handler: Type[http.server.BaseHTTPRequestHandler]) -> Iterator[str]:
+    """
+    Runs `handler` on a free local port and yields its base url
+    """
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    thread.join()
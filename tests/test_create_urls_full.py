@@ -0,0 +1,40 @@
+"""
+Tests of the batched url resolution with a stub reddit client
+"""
+from types import SimpleNamespace
+
+from create_urls_full import resolve_urls
+
+
+class StubSession:
+    """
+    Answers info requests for every known post id and records the size of each request
+    """
+
+    def __init__(self, urls) -> None:
+        self.urls = urls
+        self.batch_sizes = []
+
+    def info(self, fullnames):
+        self.batch_sizes.append(len(fullnames))
+        for fullname in fullnames:
+            post_id = fullname[len("t3_"):]
+            if post_id in self.urls:
+                yield SimpleNamespace(id=post_id, url=self.urls[post_id])
+
+
+def test_resolves_in_batches_of_100_and_reruns_from_cache(tmp_path):
+    cache_path = str(tmp_path / "resolved_urls.tsv")
+    ids = [f"id{i:03d}" for i in range(250)]
+    session = StubSession({i: f"https://a.com/{i}" for i in ids[:-1]})
+
+    resolved = resolve_urls(session, ids, cache_path)
+
+    assert session.batch_sizes == [100, 100, 50]
+    assert resolved[ids[0]] == "https://a.com/id000"
+    # Posts reddit does not know are cached with an empty url
+    assert resolved[ids[-1]] == ""
+
+    rerun_session = StubSession({})
+    assert resolve_urls(rerun_session, ids, cache_path) == resolved
+    assert rerun_session.batch_sizes == []
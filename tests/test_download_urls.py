@@ -0,0 +1,67 @@
+"""
+Tests of the incremental praw fetcher with a stub reddit client
+"""
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import download_urls
+from common import read_table
+from download_urls import HighWaterMark, fetch_url_dataset_praw, update_url_dataset_praw, write_high_water_mark
+
+
+def make_post(n: int) -> SimpleNamespace:
+    return SimpleNamespace(
+        id=f"p{n}", created_utc=1000.0 + n, title=f"Title {n} | target", url=f"https://a.com/{n}", is_robot_indexable=True
+    )
+
+
+class StubReddit:
+    """
+    Lists the posts of a subreddit newest first and counts how many were read
+    """
+
+    def __init__(self, posts) -> None:
+        self.posts = sorted(posts, key=lambda p: p.created_utc, reverse=True)
+        self.n_read = 0
+
+    def subreddit(self, name: str) -> "StubReddit":
+        return self
+
+    def new(self, limit=None):
+        for post in self.posts:
+            self.n_read += 1
+            yield post
+
+
+def test_stops_at_high_water_mark():
+    reddit = StubReddit(make_post(n) for n in range(1, 11))
+    posts, mark = fetch_url_dataset_praw(reddit, HighWaterMark("p7", 1007.0))
+
+    assert sorted(posts) == ["p10", "p8", "p9"]
+    assert mark == HighWaterMark("p10", 1010.0)
+    # The listing is not read past the mark
+    assert reddit.n_read == 4
+
+
+def test_mark_moves_only_after_table_is_written(tmp_path, monkeypatch):
+    raw_urls_path = str(tmp_path / "syac_urls_raw.tsv")
+    mark_path = str(tmp_path / "high_water_mark.json")
+    write_high_water_mark(mark_path, HighWaterMark("p2", 1002.0))
+    reddit = StubReddit(make_post(n) for n in range(1, 6))
+
+    def failing_write(post_dict, path):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(download_urls, "write_raw_urls", failing_write)
+    with pytest.raises(OSError):
+        update_url_dataset_praw(reddit, raw_urls_path, mark_path, "savedyouaclick")
+    with open(mark_path) as f:
+        assert json.load(f)["id"] == "p2"
+
+    monkeypatch.undo()
+    assert update_url_dataset_praw(reddit, raw_urls_path, mark_path, "savedyouaclick") == 3
+    assert sorted(read_table(raw_urls_path).index) == ["p3", "p4", "p5"]
+    with open(mark_path) as f:
+        assert json.load(f)["id"] == "p5"
@@ -0,0 +1,93 @@
+"""
+Tests of the asyncio fetch engine against a local stub HTTP server
+"""
+import asyncio
+import http.server
+from collections import Counter
+
+import pytest
+from conftest import serve
+
+from fetcher import fetch_all, fetch_all_async
+from http_cache import HttpCache
+
+# Paths answering 429 to their first request
+THROTTLED_PATHS = {"/throttled"}
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    requests = Counter()
+
+    def do_GET(self) -> None:
+        StubHandler.requests[self.path] += 1
+        if self.path in THROTTLED_PATHS and StubHandler.requests[self.path] == 1:
+            self.send_response(429)
+            self.send_header("Retry-After", "1")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if self.headers.get("If-None-Match") == f'"{self.path}"':
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = f"<html>{self.path}</html>".encode("UTF8")
+        self.send_response(200)
+        self.send_header("ETag", f'"{self.path}"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+@pytest.fixture
+def server():
+    StubHandler.requests.clear()
+    with serve(StubHandler) as base_url:
+        yield base_url
+
+
+def test_throttled_request_is_queued_again(server):
+    results = []
+    urls = {"1": f"{server}/throttled", "2": f"{server}/page"}
+    stats = fetch_all(urls, results.append, rate=50.0, max_rate=50.0)
+
+    assert sorted((r.id, r.status) for r in results) == [("1", 200), ("2", 200)]
+    assert stats.throttled == 1
+    assert StubHandler.requests["/throttled"] == 2
+
+
+def test_failing_handler_is_raised_instead_of_hanging(server):
+    def handle_result(result) -> None:
+        raise OSError("disk full")
+
+    urls = {str(i): f"{server}/page{i}" for i in range(20)}
+    with pytest.raises(OSError, match="disk full"):
+        asyncio.run(asyncio.wait_for(fetch_all_async(urls, handle_result, concurrency=4, rate=50.0), timeout=30))
+
+
+def test_cached_pages_are_not_requested_again(server, tmp_path):
+    urls = {str(i): f"{server}/page{i}" for i in range(5)}
+    with HttpCache(str(tmp_path / "http_cache.sqlite")) as cache:
+        fetch_all(urls, lambda result: None, rate=50.0, cache=cache)
+        results = []
+        stats = fetch_all(urls, results.append, rate=50.0, cache=cache)
+
+    assert stats.cached == 5
+    assert all(r.cached and r.status == 200 for r in results)
+    assert sum(StubHandler.requests.values()) == 5
+
+
+def test_revalidated_pages_are_served_from_cache(server, tmp_path):
+    urls = {str(i): f"{server}/page{i}" for i in range(5)}
+    with HttpCache(str(tmp_path / "http_cache.sqlite")) as cache:
+        fetch_all(urls, lambda result: None, rate=50.0, cache=cache)
+        results = []
+        stats = fetch_all(urls, results.append, rate=50.0, cache=cache, revalidate=True)
+
+    assert stats.cached == 5 and cache.stats.revalidated == 5
+    assert sorted(r.content for r in results) == [f"<html>/page{i}</html>".encode("UTF8") for i in range(5)]
+    assert sum(StubHandler.requests.values()) == 10
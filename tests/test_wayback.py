@@ -0,0 +1,73 @@
+"""
+Tests of the CDX snapshot resolution against a local stub CDX endpoint
+"""
+import http.server
+import json
+from collections import Counter
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+from conftest import serve
+
+from wayback import resolve_snapshots
+
+# CDX answers by original url
+CAPTURES = {"http://a.com/ok": [["timestamp", "original", "statuscode"], ["20180102030405", "http://a.com/ok", "200"]]}
+NOT_CAPTURED = {"http://a.com/none"}
+ERROR = {"http://a.com/error"}
+MALFORMED = {"http://a.com/malformed"}
+
+
+class StubCdxHandler(http.server.BaseHTTPRequestHandler):
+    queries = Counter()
+
+    def do_GET(self) -> None:
+        original = parse_qs(urlsplit(self.path).query)["url"][0]
+        StubCdxHandler.queries[original] += 1
+
+        if original in ERROR:
+            status, body = 500, b"Internal Server Error"
+        elif original in MALFORMED:
+            status, body = 200, b"<html>not json</html>"
+        elif original in NOT_CAPTURED:
+            status, body = 200, b"[]"
+        else:
+            status, body = 200, json.dumps(CAPTURES[original]).encode("UTF8")
+
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+@pytest.fixture
+def endpoint():
+    StubCdxHandler.queries.clear()
+    with serve(StubCdxHandler) as base_url:
+        yield f"{base_url}/cdx/search/cdx"
+
+
+def test_resolve_snapshots(endpoint):
+    urls = {
+        "same1": "https://web.archive.org/web/20180101000000/http://a.com/ok",
+        "same2": "https://web.archive.org/web/20180101000000/http://a.com/ok",
+        "none": "https://web.archive.org/web/20180101000000/http://a.com/none",
+        "error": "https://web.archive.org/web/20180101000000/http://a.com/error",
+        "malformed": "https://web.archive.org/web/20180101000000/http://a.com/malformed",
+        "not_a_snapshot": "http://a.com/page",
+    }
+    resolved = resolve_snapshots(urls, endpoint=endpoint, rate=50.0, max_rate=50.0)
+
+    # Identical snapshots are queried once
+    assert StubCdxHandler.queries["http://a.com/ok"] == 1
+    assert resolved["same1"] == resolved["same2"] == "https://web.archive.org/web/20180102030405/http://a.com/ok"
+    # Without a successful capture the id is dropped
+    assert "none" not in resolved
+    # Failed or malformed answers keep the original url
+    assert resolved["error"] == urls["error"]
+    assert resolved["malformed"] == urls["malformed"]
+    assert resolved["not_a_snapshot"] == urls["not_a_snapshot"]
+    assert sum(StubCdxHandler.queries.values()) == 4